@@ -1,37 +1,65 @@
 import os
+import time
 import uuid
+import shutil
 import hashlib
 import random
+import json
+import base64
 import mimetypes
-from datetime import datetime, timedelta
-from flask import Flask, request, jsonify, redirect
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from types import SimpleNamespace
+from urllib.parse import quote, unquote
+from datetime import datetime
+from flask import Blueprint, Flask, Response, current_app, request, jsonify, redirect, url_for, send_file
 from flask_cors import CORS
+from sqlalchemy import tuple_
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
 from werkzeug.utils import secure_filename
 
 from config import Config
-from models import db, init_db, User, File
-from auth import generate_token, token_required, create_session
+from models import db, init_db, create_search_index, User, File, UploadJob
+from auth import (
+    generate_token, token_required, identity_required, create_session, invalidate_session,
+    invalidate_user, get_request_token, sign_file_link, verify_file_link, sweep_sessions, session_sweeper
+)
 from telegram_handler import telegram_handler
+from telegram_scheduler import PRIORITY_AUTH
+from cache import TTLCache, SQLiteCacheBackend
+from chunked_upload import chunked_uploads
+from upload_jobs import upload_queue
+from storage_stats import storage_stats
+from content_cache import content_cache
+from counters import download_counter
+from content_index import content_index
+from thumbnails import thumbnails
+from search import file_search
+from otp_store import otp_store
 
-# Initialize Flask app
-app = Flask(__name__)
-app.config.from_object(Config)
+# Routes and CLI commands, registered on the app by create_app()
+api = Blueprint('api', __name__, cli_group=None)
 
-# CORS
-CORS(app, resources={r"/api/*": {"origins": "*"}}, supports_credentials=True)
+# Bot update endpoint, only registered in webhook mode
+webhook = Blueprint('webhook', __name__)
 
-# Initialize database
-init_db(app)
+# Telegram file path cache (LRU + TTL, optionally shared between workers through SQLite)
+file_url_cache = TTLCache(
+    Config.FILE_URL_CACHE_SIZE,
+    Config.FILE_URL_CACHE_TTL,
+    refresh_ahead=Config.FILE_URL_CACHE_REFRESH_AHEAD,
+    backend=SQLiteCacheBackend(Config.FILE_URL_CACHE_DB, 'file_paths') if Config.FILE_URL_CACHE_DB else None
+)
 
-# Upload folder
-os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
+# Public share metadata by link hash (per process)
+share_cache = TTLCache(Config.SHARE_CACHE_SIZE, Config.SHARE_CACHE_TTL)
 
-# OTP Storage
-otp_storage = {}
+# Bounded pool for preview file path lookups
+preview_executor = ThreadPoolExecutor(max_workers=Config.PREVIEW_WORKERS, thread_name_prefix='preview')
 
-# File URL Cache
-file_url_cache = {}
-CACHE_DURATION = 3600
+# Parts of striped files fetched ahead of the one being streamed
+stripe_executor = ThreadPoolExecutor(max_workers=Config.STRIPE_DOWNLOAD_WORKERS, thread_name_prefix='stripe')
 
 
 def generate_otp():
@@ -70,22 +98,521 @@ def format_file_size(size_bytes):
     return f"{size_bytes:.1f} TB"
 
 
-def get_cached_file_url(file_id):
-    now = datetime.now().timestamp()
-    if file_id in file_url_cache:
-        cached = file_url_cache[file_id]
-        if now - cached['time'] < CACHE_DURATION:
-            return cached['url']
-    result = telegram_handler.get_file_url(file_id)
-    if result['success']:
-        file_url_cache[file_id] = {'url': result['url'], 'time': now}
-        return result['url']
+def get_cached_file_path(file_id, shard=None):
+    def load():
+        result = telegram_handler.get_file_url(file_id, shard)
+        return result['file_path'] if result['success'] else None
+    
+    return file_url_cache.get_or_load(file_id, load)
+
+
+def get_shared_file(hash):
+    """Metadata of a public file, hot hashes are answered from share_cache"""
+    def load():
+        file_record = File.query.filter_by(public_link_hash=hash, is_public=True).first()
+        if not file_record or not file_record.telegram_file_id:
+            return None
+        return SimpleNamespace(
+            id=file_record.id,
+            telegram_file_id=file_record.telegram_file_id,
+            original_filename=file_record.original_filename,
+            file_size=file_record.file_size,
+            mime_type=file_record.mime_type,
+            upload_date=file_record.upload_date,
+            part_count=file_record.part_count,
+            shard=file_record.shard
+        )
+    
+    return share_cache.get_or_load(hash, load)
+
+
+def stream_link(file_record, download=False):
+    """
+    Signed link to the streaming proxy, so the bot token never reaches clients.
+    The expiry is rounded to the link TTL so the URL (and browser cache) stays stable.
+    """
+    ttl = Config.STREAM_LINK_TTL
+    expires = (int(time.time()) // ttl + 2) * ttl
+    params = {'expires': expires, 'sig': sign_file_link(file_record.id, expires)}
+    if download:
+        params['download'] = 1
+    return url_for('api.stream_file', file_id=file_record.id, _external=True, **params)
+
+
+def thumbnail_link(file_record):
+    """
+    Signed thumbnail link. It only grants the thumbnail, so it can live for
+    THUMBNAIL_LINK_TTL and the URL stays the same while browsers cache it.
+    """
+    ttl = Config.THUMBNAIL_LINK_TTL
+    expires = (int(time.time()) // ttl + 2) * ttl
+    sig = sign_file_link(f"{file_record.id}:thumbnail", expires)
+    return url_for('api.file_thumbnail', file_id=file_record.id, expires=expires, sig=sig, _external=True)
+
+
+def get_thumbnail_path(file_record):
+    """Local path of the file's thumbnail, fetched from Telegram or rendered on first use (or None)"""
+    if file_record.thumb_file_id and file_record.thumb_size:
+        size = file_record.thumb_size
+        path, _ = thumbnails.cache.get_or_fill(
+            thumbnails.telegram_key(file_record), size,
+            lambda: open_stored_range(file_record.thumb_file_id, file_record.shard, size, 0, size - 1)
+        )
+        if path:
+            return path
+    
+    if thumbnails.can_render(file_record):
+        size = file_record.file_size
+        path, _ = thumbnails.cache.get_or_fill(
+            thumbnails.rendered_key(file_record), None,
+            lambda: thumbnails.render(open_file_range(file_record, 0, size - 1))
+        )
+        if not path:
+            thumbnails.render_failed(file_record)
+        return path
     return None
 
 
+def encode_cursor(file_record):
+    value = json.dumps([file_record.upload_date.isoformat(), file_record.id])
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(cursor):
+    upload_date, file_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return datetime.fromisoformat(upload_date), file_id
+
+
+def resolve_file_paths(files, deadline=None):
+    """
+    Resolve the Telegram file paths of many files concurrently (bounded pool),
+    by telegram_file_id. Anything not resolved within the deadline comes back
+    as None; the lookup keeps running in the background and warms the cache.
+    """
+    paths = {}
+    futures = {}
+    for file_id, shard in {(f.telegram_file_id, f.shard) for f in files}:
+        path = file_url_cache.get(file_id)
+        if path:
+            paths[file_id] = path
+        else:
+            futures[preview_executor.submit(get_cached_file_path, file_id, shard)] = file_id
+    
+    if futures:
+        done, _ = wait(futures, timeout=Config.PREVIEW_DEADLINE if deadline is None else deadline)
+        for future, file_id in futures.items():
+            paths[file_id] = future.result() if future in done and not future.exception() else None
+    
+    return paths
+
+
+def file_etag(file_record):
+    return hashlib.sha1(f"{file_record.telegram_file_id}:{file_record.file_size}".encode()).hexdigest()
+
+
+def open_file_range(file_record, start, end):
+    """
+    Fetch bytes start..end (inclusive) of a stored file from Telegram.
+    Returns an iterator of blocks, or None if the file can't be fetched.
+    Striped files only fetch the parts the range covers.
+    """
+    parts = content_index.get_parts(file_record)
+    if not parts:
+        return open_stored_range(file_record.telegram_file_id, file_record.shard, file_record.file_size, start, end)
+    
+    # Every part is on the file's shard
+    ranges = [
+        (part.telegram_file_id, file_record.shard, part.size,
+         max(start, part.offset) - part.offset, min(end, part.offset + part.size - 1) - part.offset)
+        for part in parts if part.offset <= end and part.offset + part.size > start
+    ]
+    first = open_stored_range(*ranges[0]) if ranges else None
+    if first is None:
+        return None
+    return iter_striped_range(first, ranges[1:])
+
+
+def open_stored_range(telegram_file_id, shard, size, start, end):
+    """open_file_range() for one stored message"""
+    headers = None
+    if start > 0 or end < size - 1:
+        headers = {'Range': f'bytes={start}-{end}'}
+    
+    for _ in range(2):
+        file_path = get_cached_file_path(telegram_file_id, shard)
+        if not file_path:
+            return None
+        response = telegram_handler.download(file_path, shard, headers=headers)
+        if response.status_code in (200, 206):
+            break
+        response.close()
+        # Cached path went stale, look it up again
+        file_url_cache.invalidate(telegram_file_id)
+    else:
+        return None
+    
+    # A 200 means the range was ignored, skip up to start ourselves
+    skip = start if response.status_code == 200 else 0
+    return iter_response_range(response, skip, end - start + 1)
+
+
+def spool_stored_range(telegram_file_id, shard, size, start, end):
+    """Download a part range to a temp file, returns it rewound (or None)"""
+    spool = tempfile.TemporaryFile()
+    try:
+        body = open_stored_range(telegram_file_id, shard, size, start, end)
+        if body is None:
+            raise IOError('File part unavailable')
+        for block in body:
+            spool.write(block)
+    except Exception:
+        spool.close()
+        return None
+    spool.seek(0)
+    return spool
+
+
+def iter_striped_range(first, ranges):
+    """
+    Stream the first part straight through while the next STRIPE_DOWNLOAD_AHEAD
+    parts download in parallel to temp files, then stream those in order.
+    """
+    pending = iter(ranges)
+    ahead = deque()
+    
+    def fill():
+        while len(ahead) < Config.STRIPE_DOWNLOAD_AHEAD:
+            part_range = next(pending, None)
+            if part_range is None:
+                return
+            ahead.append(stripe_executor.submit(spool_stored_range, *part_range))
+    
+    try:
+        fill()
+        yield from first
+        while ahead:
+            spool = ahead.popleft().result()
+            fill()
+            if spool is None:
+                raise IOError('File part unavailable')
+            with spool:
+                while True:
+                    block = spool.read(Config.STREAM_BLOCK_SIZE)
+                    if not block:
+                        break
+                    yield block
+    finally:
+        # Client went away, drop what was fetched ahead
+        for future in ahead:
+            if not future.cancel():
+                future.add_done_callback(lambda f: f.result() and f.result().close())
+
+
+def iter_response_range(response, skip, length):
+    try:
+        for block in response.iter_content(Config.STREAM_BLOCK_SIZE):
+            if skip:
+                if len(block) <= skip:
+                    skip -= len(block)
+                    continue
+                block = block[skip:]
+                skip = 0
+            if len(block) >= length:
+                yield block[:length]
+                return
+            length -= len(block)
+            yield block
+    finally:
+        response.close()
+
+
+def range_satisfiable(byte_range, size):
+    """Whether any range of a Range header overlaps a file of size bytes"""
+    # Suffix ranges (bytes=-N) have a negative start
+    return any(start < size if start >= 0 else size > 0 for start, _ in byte_range.ranges)
+
+
+def send_cached_file(file_record, etag, mimetype, as_attachment, whole=False):
+    """Serve from the local content cache (filling it on a GET miss), or None to proxy instead"""
+    key = file_record.telegram_file_id
+    if request.method == 'HEAD':
+        path, fetched = content_cache.get(key), False
+    else:
+        size = file_record.file_size
+        path, fetched = content_cache.get_or_fill(key, size, lambda: open_file_range(file_record, 0, size - 1))
+    if not path:
+        return None
+    
+    try:
+        # send_file handles Range/If-Range and hands the file to the server's sendfile wrapper
+        response = send_file(
+            path, mimetype=mimetype, as_attachment=as_attachment,
+            download_name=file_record.original_filename, conditional=not whole, etag=etag,
+            last_modified=file_record.upload_date
+        )
+        response.headers['Accept-Ranges'] = 'bytes'
+    except FileNotFoundError:
+        # Evicted between lookup and open
+        return None
+    except RequestedRangeNotSatisfiable as e:
+        return e.get_response()
+    if not fetched and request.method != 'HEAD' and response.status_code in (200, 206):
+        content_cache.record_served(response.content_length or 0)
+    return response
+
+
+def stream_file_response(file_record, as_attachment=False, cache_control='no-cache'):
+    """Proxy a stored file with Range/206, ETag/304 and Content-Length, streaming in bounded blocks"""
+    etag = file_etag(file_record)
+    disposition = 'attachment' if as_attachment else 'inline'
+    headers = {
+        'ETag': f'"{etag}"',
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': cache_control,
+        'Content-Disposition': f"{disposition}; filename*=UTF-8''{quote(file_record.original_filename)}"
+    }
+    mimetype = file_record.mime_type or 'application/octet-stream'
+    
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+    
+    size = file_record.file_size
+    # If-Range with another validator means the client's partial copy is stale, send it all
+    use_range = request.range and (not request.headers.get('If-Range') or request.if_range.etag == etag)
+    whole = False
+    if use_range and len(request.range.ranges) > 1:
+        # Multiple ranges are answered with the whole file (no multipart/byteranges)
+        if not range_satisfiable(request.range, size):
+            headers['Content-Range'] = f'bytes */{size}'
+            return Response(status=416, headers=headers)
+        use_range, whole = False, True
+    elif request.headers.get('Range') and not request.range:
+        # A Range header that doesn't parse is ignored, as the proxy path does
+        whole = True
+    
+    response = send_cached_file(file_record, etag, mimetype, as_attachment, whole=whole)
+    if response is not None:
+        response.headers['Cache-Control'] = cache_control
+        return response
+    
+    start, end, status = 0, size - 1, 200
+    if use_range:
+        byte_range = request.range.range_for_length(size)
+        if byte_range is None:
+            headers['Content-Range'] = f'bytes */{size}'
+            return Response(status=416, headers=headers)
+        start, end, status = byte_range[0], byte_range[1] - 1, 206
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    
+    headers['Content-Length'] = str(end - start + 1)
+    if request.method == 'HEAD' or size == 0:
+        return Response(status=status, headers=headers, mimetype=mimetype)
+    
+    body = open_file_range(file_record, start, end)
+    if body is None:
+        return jsonify({'success': False, 'error': 'File unavailable'}), 502
+    return Response(body, status=status, headers=headers, mimetype=mimetype, direct_passthrough=True)
+
+
+def store_file(user, file_path, original_filename, progress=None):
+    """Send a local file to hidden storage and record it for the user (caller commits)"""
+    file_size = os.path.getsize(file_path)
+    
+    sha256 = content_index.hash_file(file_path)
+    blob = content_index.acquire(user.id, sha256)
+    if blob:
+        # Same content is already stored, only the metadata is new
+        file_record = create_file_record(user, content_index.as_result(blob), original_filename, file_size)
+        return {'success': True, 'file': file_record, 'deduplicated': True}
+    
+    result = telegram_handler.send_file_to_storage(
+        file_path=file_path,
+        filename=original_filename,
+        user_phone=user.phone_number or str(user.telegram_id),
+        progress=progress,
+        sha256=sha256
+    )
+    
+    if not result['success']:
+        return {'success': False, 'error': result.get('error', 'Upload failed')}
+    
+    return {'success': True, 'file': record_upload(user, result, original_filename, file_size)}
+
+
+def record_upload(user, result, original_filename, file_size):
+    """Index freshly uploaded content and record the file (caller commits)"""
+    blob = content_index.register(user.id, result, file_size)
+    if blob.telegram_file_id != result['file_id']:
+        # The same content was stored concurrently, keep one copy
+        stored = result.get('parts') or [result]
+        telegram_handler.delete_stored_later(result['shard'], [s.get('message_id') for s in stored])
+    return create_file_record(user, content_index.as_result(blob), original_filename, file_size)
+
+
+def create_file_record(user, result, original_filename, file_size):
+    """Record a file that is already in hidden storage (caller commits)"""
+    file_type = get_file_type(original_filename)
+    mime_type, _ = mimetypes.guess_type(original_filename)
+    
+    file_record = File(
+        user_id=user.id,
+        telegram_file_id=result['file_id'],
+        telegram_message_id=result.get('message_id'),
+        original_filename=original_filename,
+        file_size=file_size,
+        file_type=file_type,
+        mime_type=mime_type,
+        sha256=result.get('sha256'),
+        part_count=result.get('part_count'),
+        shard=result.get('shard'),
+        thumb_file_id=result.get('thumb_file_id'),
+        thumb_size=result.get('thumb_size')
+    )
+    db.session.add(file_record)
+    user.storage_used += file_size
+    storage_stats.file_added(file_record)
+    
+    return file_record
+
+
+def store_files(user, staged):
+    """
+    store_file() for many local files [(original_filename, path)]: known content
+    is recorded at once, the rest is sent to storage in parallel (caller commits).
+    Returns one result dict per file, in order.
+    """
+    results = [None] * len(staged)
+    uploads = {}
+    for i, (original_filename, file_path) in enumerate(staged):
+        sha256 = content_index.hash_file(file_path)
+        blob = content_index.acquire(user.id, sha256)
+        if blob:
+            file_record = create_file_record(
+                user, content_index.as_result(blob), original_filename, os.path.getsize(file_path)
+            )
+            results[i] = {'success': True, 'file': file_record, 'deduplicated': True}
+        else:
+            uploads[i] = sha256
+    
+    # The storage channel may need a database lookup, so it is resolved here rather than in the workers
+    if uploads and not telegram_handler.get_storage_channel():
+        for i in uploads:
+            results[i] = {'success': False, 'error': 'No storage configured'}
+        uploads = {}
+    
+    if uploads:
+        # Database work stays on this thread, the workers only talk to Telegram
+        user_phone = user.phone_number or str(user.telegram_id)
+        user_data = telegram_handler.get_telegram_id_by_phone(user_phone)
+        user_telegram_id = user_data.get('telegram_id') if user_data else None
+        
+        with ThreadPoolExecutor(max_workers=Config.BULK_UPLOAD_WORKERS, thread_name_prefix='bulk-upload') as executor:
+            futures = {
+                i: executor.submit(
+                    telegram_handler.upload_file_hidden, staged[i][1], staged[i][0],
+                    user_telegram_id, user_phone, sha256=sha256
+                )
+                for i, sha256 in uploads.items()
+            }
+            for i, future in futures.items():
+                result = future.result()
+                original_filename, file_path = staged[i]
+                if result['success']:
+                    file_record = record_upload(user, result, original_filename, os.path.getsize(file_path))
+                    results[i] = {'success': True, 'file': file_record}
+                else:
+                    results[i] = {'success': False, 'error': result.get('error', 'Upload failed')}
+    
+    return results
+
+
+def remove_files(user, files):
+    """
+    Delete file records in the caller's transaction, with one storage_used update.
+    Returns a function to call after the commit: it queues the storage message
+    deletes (batched per channel) and drops cached paths, content and shares.
+    """
+    stored = {}
+    share_hashes = []
+    thumbnail_keys = []
+    for file_record in files:
+        if content_index.release(file_record):
+            # Last file using this content
+            for telegram_file_id, message_id in content_index.discard(file_record):
+                stored.setdefault(file_record.shard or 0, []).append((telegram_file_id, message_id))
+            thumbnail_keys.extend(thumbnails.cache_keys(file_record))
+        if file_record.public_link_hash:
+            share_hashes.append(file_record.public_link_hash)
+        db.session.delete(file_record)
+    
+    storage_stats.files_removed(files)
+    user.storage_used = max(0, (user.storage_used or 0) - sum(f.file_size or 0 for f in files))
+    
+    def forget():
+        for shard, messages in stored.items():
+            telegram_handler.delete_stored_later(shard, [message_id for _, message_id in messages])
+            for telegram_file_id, _ in messages:
+                file_url_cache.invalidate(telegram_file_id)
+                content_cache.invalidate(telegram_file_id)
+        for link_hash in share_hashes:
+            share_cache.invalidate(link_hash)
+        for key in thumbnail_keys:
+            thumbnails.cache.invalidate(key)
+    
+    return forget
+
+
+def new_share_hash(file_id):
+    return hashlib.sha256(f"{file_id}{datetime.now().isoformat()}{random.random()}".encode()).hexdigest()[:16]
+
+
+def get_bulk_ids():
+    """File ids of a bulk request, or None if missing or too many"""
+    data = request.json
+    ids = data.get('ids') if data else None
+    if not ids or not isinstance(ids, list) or len(ids) > Config.BULK_MAX_ITEMS:
+        return None
+    return list(dict.fromkeys(str(i) for i in ids))
+
+
+def bulk_results(ids, files, **extra):
+    """Per-id results of a bulk request, extra maps result keys to functions of the file"""
+    by_id = {f.id: f for f in files}
+    results = []
+    for file_id in ids:
+        file_record = by_id.get(file_id)
+        if file_record is None:
+            results.append({'id': file_id, 'success': False, 'error': 'Not found'})
+        else:
+            results.append({'id': file_id, 'success': True, **{k: fn(file_record) for k, fn in extra.items()}})
+    return results
+
+
+def process_upload_job(job, progress):
+    """Upload a queued file and record it (runs on an upload worker)"""
+    user = db.session.get(User, job.user_id)
+    if not user:
+        return {'success': False, 'error': 'User not found'}
+    
+    return store_file(user, job.staged_path, job.filename, progress=progress)
+
+
+def uploaded_file_dict(file_record):
+    preview_url = None
+    if file_record.file_type == 'image' and file_record.telegram_file_id:
+        if get_cached_file_path(file_record.telegram_file_id, file_record.shard):
+            preview_url = stream_link(file_record)
+    
+    file_dict = file_record.to_dict()
+    file_dict['download_count'] = download_counter.count(file_record)
+    file_dict['preview_url'] = preview_url
+    file_dict['thumbnail_url'] = thumbnail_link(file_record) if thumbnails.available(file_record) else None
+    return file_dict
+
+
 # ==================== AUTH ====================
 
-@app.route('/api/auth/request-otp', methods=['POST'])
+@api.route('/api/auth/request-otp', methods=['POST'])
 def request_otp():
     try:
         data = request.json
@@ -106,16 +633,14 @@ def request_otp():
         telegram_id = telegram_data['telegram_id']
         otp = generate_otp()
         
-        otp_storage[phone] = {
-            'otp': otp,
-            'expires': datetime.now() + timedelta(minutes=5),
-            'attempts': 0,
-            'telegram_id': telegram_id
-        }
+        issued = otp_store.issue(phone, otp, telegram_id)
+        if not issued['success']:
+            return jsonify(issued), 429
         
         result = telegram_handler.send_message(
             telegram_id,
-            f"🔐 <b>Verification Code</b>\n\n<code>{otp}</code>\n\nExpires in 5 minutes."
+            f"🔐 <b>Verification Code</b>\n\n<code>{otp}</code>\n\nExpires in {Config.OTP_TTL // 60} minutes.",
+            priority=PRIORITY_AUTH
         )
         
         if result['success']:
@@ -125,7 +650,7 @@ def request_otp():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/auth/verify-otp', methods=['POST'])
+@api.route('/api/auth/verify-otp', methods=['POST'])
 def verify_otp():
     try:
         data = request.json
@@ -138,25 +663,11 @@ def verify_otp():
         if not phone or not otp:
             return jsonify({'success': False, 'error': 'Phone and OTP required'}), 400
         
-        if phone not in otp_storage:
-            return jsonify({'success': False, 'error': 'OTP expired'}), 400
+        verified = otp_store.verify(phone, str(otp))
+        if not verified['success']:
+            return jsonify(verified), 400
         
-        stored = otp_storage[phone]
-        
-        if datetime.now() > stored['expires']:
-            del otp_storage[phone]
-            return jsonify({'success': False, 'error': 'OTP expired'}), 400
-        
-        if stored['attempts'] >= 3:
-            del otp_storage[phone]
-            return jsonify({'success': False, 'error': 'Too many attempts'}), 400
-        
-        if stored['otp'] != otp:
-            stored['attempts'] += 1
-            return jsonify({'success': False, 'error': f'Invalid OTP. {3-stored["attempts"]} left.'}), 400
-        
-        telegram_id = stored['telegram_id']
-        del otp_storage[phone]
+        telegram_id = verified['telegram_id']
         
         user = User.query.filter_by(phone_number=phone).first()
         
@@ -170,6 +681,7 @@ def verify_otp():
             user.last_login = datetime.now()
             user.telegram_id = telegram_id
             db.session.commit()
+            invalidate_user(user.id)
         
         token = generate_token(user.id, telegram_id)
         create_session(user, token, request)
@@ -179,15 +691,25 @@ def verify_otp():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/auth/verify', methods=['GET'])
+@api.route('/api/auth/verify', methods=['GET'])
 @token_required
 def verify_auth(user):
     return jsonify({'success': True, 'user': user.to_dict()})
 
 
+@api.route('/api/auth/logout', methods=['POST'])
+@identity_required
+def logout(user):
+    try:
+        invalidate_session(get_request_token())
+        return jsonify({'success': True, 'message': 'Logged out'})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 # ==================== FILES ====================
 
-@app.route('/api/files/upload', methods=['POST'])
+@api.route('/api/files/upload', methods=['POST'])
 @token_required
 def upload_file(user):
     try:
@@ -201,79 +723,346 @@ def upload_file(user):
         original_filename = file.filename
         secure_name = secure_filename(original_filename) or f"file_{uuid.uuid4().hex[:8]}"
         unique_filename = f"{uuid.uuid4()}_{secure_name}"
+        os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
         file_path = os.path.join(Config.UPLOAD_FOLDER, unique_filename)
         
         file.save(file_path)
-        file_size = os.path.getsize(file_path)
+        result = store_file(user, file_path, original_filename)
+        os.remove(file_path)
+        
+        if not result['success']:
+            return jsonify({'success': False, 'error': result['error']}), 500
+        
+        db.session.commit()
         
-        result = telegram_handler.send_file_to_storage(
-            file_path=file_path,
-            filename=original_filename,
-            user_phone=user.phone_number or str(user.telegram_id)
+        return jsonify({'success': True, 'file': uploaded_file_dict(result['file'])})
+    except Exception as e:
+        if 'file_path' in locals() and os.path.exists(file_path):
+            os.remove(file_path)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@api.route('/api/files/upload-stream', methods=['POST', 'PUT'])
+@token_required
+def upload_file_stream(user):
+    """
+    Raw request body is piped straight into the Telegram upload,
+    nothing is written to the local disk
+    """
+    try:
+        original_filename = unquote(request.headers.get('X-Filename') or request.args.get('filename') or '')
+        if not original_filename:
+            return jsonify({'success': False, 'error': 'Filename required'}), 400
+        
+        if not request.content_length and request.headers.get('Transfer-Encoding', '').lower() != 'chunked':
+            return jsonify({'success': False, 'error': 'No file'}), 400
+        
+        result = telegram_handler.send_stream_to_storage(
+            request.stream,
+            original_filename,
+            user.phone_number or str(user.telegram_id),
+            size=request.content_length
         )
         
         if not result['success']:
-            os.remove(file_path)
             return jsonify({'success': False, 'error': result.get('error', 'Upload failed')}), 500
         
-        file_type = get_file_type(original_filename)
-        mime_type, _ = mimetypes.guess_type(original_filename)
-        
-        file_record = File(
-            user_id=user.id,
-            telegram_file_id=result['file_id'],
-            telegram_message_id=result.get('message_id'),
-            original_filename=original_filename,
-            file_size=file_size,
-            file_type=file_type,
-            mime_type=mime_type
-        )
-        db.session.add(file_record)
-        user.storage_used += file_size
+        file_record = record_upload(user, result, original_filename, result['file_size'])
         db.session.commit()
         
-        os.remove(file_path)
+        return jsonify({'success': True, 'file': uploaded_file_dict(file_record)})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@api.route('/api/files/upload-by-hash', methods=['POST'])
+@token_required
+def upload_by_hash(user):
+    """
+    Record a file from content the user has stored before, given its SHA-256.
+    exists=false means the bytes have to be uploaded the normal way.
+    """
+    try:
+        data = request.json
+        if not data or not data.get('filename') or not data.get('sha256'):
+            return jsonify({'success': False, 'error': 'Filename and sha256 required'}), 400
         
-        preview_url = None
-        if file_type == 'image' and result.get('file_id'):
-            preview_url = get_cached_file_url(result['file_id'])
+        blob = content_index.acquire(user.id, str(data['sha256']).lower())
+        if not blob:
+            return jsonify({'success': True, 'exists': False})
         
-        file_dict = file_record.to_dict()
-        file_dict['preview_url'] = preview_url
+        file_record = create_file_record(user, content_index.as_result(blob), data['filename'], blob.file_size)
+        db.session.commit()
         
-        return jsonify({'success': True, 'file': file_dict})
+        return jsonify({'success': True, 'exists': True, 'file': uploaded_file_dict(file_record)})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@api.route('/api/files/upload-async', methods=['POST', 'PUT'])
+@token_required
+def upload_file_async(user):
+    """Stage the upload locally and return at once, an upload worker sends it to storage"""
+    try:
+        if not upload_queue.accepting():
+            return jsonify({'success': False, 'error': 'Upload workers are not running'}), 503
+        
+        file = request.files.get('file')
+        if file and file.filename:
+            original_filename = file.filename
+            staged_path = upload_queue.staging_path(original_filename)
+            file.save(staged_path)
+        else:
+            original_filename = unquote(request.headers.get('X-Filename') or request.args.get('filename') or '')
+            if not original_filename:
+                return jsonify({'success': False, 'error': 'No file'}), 400
+            staged_path = upload_queue.staging_path(original_filename)
+            with open(staged_path, 'wb') as f:
+                shutil.copyfileobj(request.stream, f, Config.STREAM_BLOCK_SIZE)
+        
+        if os.path.getsize(staged_path) == 0:
+            os.remove(staged_path)
+            return jsonify({'success': False, 'error': 'No file'}), 400
+        
+        job = upload_queue.enqueue(user, staged_path, original_filename)
+        
+        return jsonify({'success': True, 'job': job.to_dict()}), 202
+    except Exception as e:
+        if 'staged_path' in locals() and os.path.exists(staged_path):
+            os.remove(staged_path)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@api.route('/api/files/jobs', methods=['GET'])
+@identity_required
+def list_upload_jobs(user):
+    try:
+        jobs = UploadJob.query.filter_by(user_id=user.id).order_by(UploadJob.created_at.desc()).limit(50).all()
+        return jsonify({'success': True, 'jobs': [j.to_dict() for j in jobs]})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@api.route('/api/files/jobs/<job_id>', methods=['GET'])
+@identity_required
+def upload_job_status(user, job_id):
+    try:
+        job = upload_queue.get_job(user, job_id)
+        if not job:
+            return jsonify({'success': False, 'error': 'Job not found'}), 404
+        
+        job_dict = job.to_dict()
+        if job.status == 'completed' and job.file_id:
+            file_record = db.session.get(File, job.file_id)
+            job_dict['file'] = uploaded_file_dict(file_record) if file_record else None
+        
+        return jsonify({'success': True, 'job': job_dict})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@api.route('/api/files/upload/init', methods=['POST'])
+@token_required
+def init_chunked_upload(user):
+    try:
+        data = request.json
+        if not data or not data.get('filename') or not data.get('size'):
+            return jsonify({'success': False, 'error': 'Filename and size required'}), 400
+        
+        result = chunked_uploads.create_session(
+            user, data['filename'], int(data['size']), data.get('chunk_size')
+        )
+        if not result['success']:
+            return jsonify(result), 400
+        
+        return jsonify({'success': True, 'upload': result['upload'].to_dict()})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@api.route('/api/files/upload-chunk', methods=['POST', 'PUT'])
+@token_required
+def upload_chunk(user):
+    try:
+        upload_id = request.form.get('upload_id') or request.args.get('upload_id')
+        chunk_index = request.form.get('chunk_index') or request.args.get('chunk_index')
+        if not upload_id or chunk_index is None:
+            return jsonify({'success': False, 'error': 'upload_id and chunk_index required'}), 400
+        
+        upload = chunked_uploads.get_session(user, upload_id)
+        if not upload:
+            return jsonify({'success': False, 'error': 'Upload not found'}), 404
+        
+        # Multipart field from ChunkUploader, or the raw request body
+        chunk = request.files.get('chunk')
+        stream = chunk.stream if chunk else request.stream
+        
+        result = chunked_uploads.write_chunk(upload, int(chunk_index), stream)
+        if not result['success']:
+            return jsonify(result), 400
+        
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@api.route('/api/files/upload/<upload_id>', methods=['GET'])
+@identity_required
+def chunked_upload_status(user, upload_id):
+    try:
+        upload = chunked_uploads.get_session(user, upload_id)
+        if not upload:
+            return jsonify({'success': False, 'error': 'Upload not found'}), 404
+        
+        return jsonify({'success': True, 'upload': upload.to_dict()})
     except Exception as e:
-        if 'file_path' in locals() and os.path.exists(file_path):
-            os.remove(file_path)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/files/list', methods=['GET'])
+@api.route('/api/files/upload/<upload_id>/complete', methods=['POST'])
 @token_required
+def complete_chunked_upload(user, upload_id):
+    try:
+        upload = chunked_uploads.get_session(user, upload_id)
+        if not upload:
+            return jsonify({'success': False, 'error': 'Upload not found'}), 404
+        
+        finished = chunked_uploads.finish(upload)
+        if not finished['success']:
+            return jsonify(finished), 400
+        
+        if request.args.get('async'):
+            if not upload_queue.accepting():
+                return jsonify({'success': False, 'error': 'Upload workers are not running'}), 503
+            # Hand the assembled file to the upload workers
+            staged_path = upload_queue.staging_path(upload.filename)
+            os.replace(finished['file_path'], staged_path)
+            job = upload_queue.enqueue(user, staged_path, upload.filename)
+            chunked_uploads.discard(upload)
+            return jsonify({'success': True, 'job': job.to_dict()}), 202
+        
+        result = store_file(user, finished['file_path'], upload.filename)
+        if not result['success']:
+            # Keep the session so the client can retry the finalize step
+            return jsonify({'success': False, 'error': result['error']}), 500
+        
+        db.session.commit()
+        chunked_uploads.discard(upload)
+        
+        return jsonify({'success': True, 'file': uploaded_file_dict(result['file'])})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@api.route('/api/files/list', methods=['GET'])
+@identity_required
 def list_files(user):
     try:
         file_type = request.args.get('type')
+        limit = min(request.args.get('limit', Config.FILES_PAGE_SIZE, type=int), Config.FILES_MAX_PAGE_SIZE)
+        if limit <= 0:
+            return jsonify({'success': False, 'error': 'Invalid limit'}), 400
+        
         query = File.query.filter_by(user_id=user.id)
         
         if file_type:
             query = query.filter_by(file_type=file_type)
         
-        files = query.order_by(File.upload_date.desc()).all()
+        # Keyset pagination, served straight from the (user_id, [file_type,] upload_date, id) indexes
+        cursor = request.args.get('cursor')
+        if cursor:
+            try:
+                cursor_date, cursor_id = decode_cursor(cursor)
+            except (ValueError, TypeError):
+                return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+            query = query.filter(tuple_(File.upload_date, File.id) < tuple_(cursor_date, cursor_id))
+        
+        files = query.order_by(File.upload_date.desc(), File.id.desc()).limit(limit + 1).all()
+        has_more = len(files) > limit
+        files = files[:limit]
+        
+        # Previews not resolved in time are null, the client fetches them via /api/files/previews
+        file_paths = resolve_file_paths([f for f in files if f.file_type == 'image' and f.telegram_file_id])
         
         files_list = []
         for f in files:
             fd = f.to_dict()
+            fd['download_count'] = download_counter.count(f)
             if f.file_type == 'image' and f.telegram_file_id:
-                fd['preview_url'] = get_cached_file_url(f.telegram_file_id)
+                fd['preview_url'] = stream_link(f) if file_paths.get(f.telegram_file_id) else None
+            fd['thumbnail_url'] = thumbnail_link(f) if thumbnails.available(f) else None
             files_list.append(fd)
         
-        return jsonify({'success': True, 'files': files_list, 'count': len(files)})
+        return jsonify({
+            'success': True,
+            'files': files_list,
+            'count': len(files),
+            'has_more': has_more,
+            'next_cursor': encode_cursor(files[-1]) if has_more else None
+        })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/files/<file_id>/download', methods=['GET'])
-@token_required
+@api.route('/api/files/search', methods=['GET'])
+@identity_required
+def search_files(user):
+    try:
+        terms = file_search.terms(request.args.get('q'))
+        if not terms:
+            return jsonify({'success': False, 'error': 'Search query required'}), 400
+        
+        limit = min(request.args.get('limit', Config.SEARCH_PAGE_SIZE, type=int), Config.FILES_MAX_PAGE_SIZE)
+        offset = request.args.get('offset', 0, type=int)
+        if limit <= 0:
+            return jsonify({'success': False, 'error': 'Invalid limit'}), 400
+        if offset < 0 or offset > Config.SEARCH_MAX_OFFSET:
+            return jsonify({'success': False, 'error': f'Offset must be between 0 and {Config.SEARCH_MAX_OFFSET}'}), 400
+        
+        files = file_search.search(user.id, terms, file_type=request.args.get('type'), limit=limit, offset=offset)
+        has_more = len(files) > limit and offset + limit <= Config.SEARCH_MAX_OFFSET
+        files = files[:limit]
+        
+        files_list = []
+        for f in files:
+            fd = f.to_dict()
+            fd['download_count'] = download_counter.count(f)
+            fd['thumbnail_url'] = thumbnail_link(f) if thumbnails.available(f) else None
+            files_list.append(fd)
+        
+        return jsonify({
+            'success': True,
+            'files': files_list,
+            'count': len(files),
+            'has_more': has_more,
+            'next_offset': offset + limit if has_more else None
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@api.route('/api/files/previews', methods=['POST'])
+@identity_required
+def file_previews(user):
+    try:
+        data = request.json
+        ids = data.get('ids') if data else None
+        if not ids or not isinstance(ids, list):
+            return jsonify({'success': False, 'error': 'ids required'}), 400
+        if len(ids) > Config.PREVIEW_BATCH_LIMIT:
+            return jsonify({'success': False, 'error': f'At most {Config.PREVIEW_BATCH_LIMIT} ids'}), 400
+        
+        files = File.query.filter(File.user_id == user.id, File.id.in_(ids)).all()
+        file_paths = resolve_file_paths([f for f in files if f.telegram_file_id])
+        
+        previews = {f.id: stream_link(f) if file_paths.get(f.telegram_file_id) else None for f in files}
+        return jsonify({'success': True, 'previews': previews})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@api.route('/api/files/<file_id>/download', methods=['GET'])
+@identity_required
 def download_file(user, file_id):
     try:
         file_record = File.query.filter_by(id=file_id, user_id=user.id).first()
@@ -284,24 +1073,67 @@ def download_file(user, file_id):
         if not file_record.telegram_file_id:
             return jsonify({'success': False, 'error': 'File data missing'}), 500
         
-        download_url = get_cached_file_url(file_record.telegram_file_id)
+        download_counter.increment(file_record.id)
         
-        if not download_url:
-            result = telegram_handler.get_file_url(file_record.telegram_file_id)
-            if result['success']:
-                download_url = result['url']
-            else:
-                return jsonify({'success': False, 'error': 'Could not get download URL'}), 500
+        return jsonify({
+            'success': True,
+            'download_url': stream_link(file_record, download=True),
+            'filename': file_record.original_filename
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@api.route('/api/files/<file_id>/stream', methods=['GET'])
+def stream_file(file_id):
+    """Signed links, so <img>/<video> tags and download managers work without the auth header"""
+    try:
+        expires = request.args.get('expires')
+        if not verify_file_link(file_id, expires, request.args.get('sig')):
+            return jsonify({'success': False, 'error': 'Invalid or expired link'}), 403
         
-        file_record.download_count += 1
-        db.session.commit()
+        file_record = db.session.get(File, file_id)
+        if not file_record or not file_record.telegram_file_id:
+            return jsonify({'success': False, 'error': 'Not found'}), 404
         
-        return jsonify({'success': True, 'download_url': download_url, 'filename': file_record.original_filename})
+        max_age = max(0, int(expires) - int(time.time()))
+        return stream_file_response(
+            file_record,
+            as_attachment=request.args.get('download') == '1',
+            cache_control=f'private, max-age={max_age}'
+        )
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/files/<file_id>', methods=['DELETE'])
+@api.route('/api/files/<file_id>/thumbnail', methods=['GET'])
+def file_thumbnail(file_id):
+    """Signed like /stream; a thumbnail never changes, so browsers keep it until the link expires"""
+    try:
+        expires = request.args.get('expires')
+        if not verify_file_link(f"{file_id}:thumbnail", expires, request.args.get('sig')):
+            return jsonify({'success': False, 'error': 'Invalid or expired link'}), 403
+        
+        file_record = db.session.get(File, file_id)
+        if not file_record or not thumbnails.available(file_record):
+            return jsonify({'success': False, 'error': 'Not found'}), 404
+        
+        path = get_thumbnail_path(file_record)
+        if not path:
+            return jsonify({'success': False, 'error': 'Thumbnail unavailable'}), 404
+        
+        max_age = max(0, int(expires) - int(time.time()))
+        response = send_file(
+            path, mimetype='image/jpeg', conditional=True, etag=f"{file_etag(file_record)}-thumb",
+            last_modified=file_record.upload_date, max_age=max_age
+        )
+        response.headers['Cache-Control'] = f'private, max-age={max_age}, immutable'
+        return response
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@api.route('/api/files/<file_id>', methods=['DELETE'])
 @token_required
 def delete_file(user, file_id):
     try:
@@ -310,24 +1142,17 @@ def delete_file(user, file_id):
         if not file_record:
             return jsonify({'success': False, 'error': 'Not found'}), 404
         
-        storage_channel = telegram_handler.get_storage_channel()
-        if file_record.telegram_message_id and storage_channel:
-            telegram_handler.delete_message(storage_channel, file_record.telegram_message_id)
-        
-        if file_record.telegram_file_id in file_url_cache:
-            del file_url_cache[file_record.telegram_file_id]
-        
-        user.storage_used = max(0, user.storage_used - file_record.file_size)
-        db.session.delete(file_record)
+        forget = remove_files(user, [file_record])
         db.session.commit()
+        forget()
         
         return jsonify({'success': True, 'message': 'Deleted'})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/files/<file_id>/share', methods=['POST'])
-@token_required
+@api.route('/api/files/<file_id>/share', methods=['POST'])
+@identity_required
 def share_file(user, file_id):
     try:
         file_record = File.query.filter_by(id=file_id, user_id=user.id).first()
@@ -336,47 +1161,154 @@ def share_file(user, file_id):
             return jsonify({'success': False, 'error': 'Not found'}), 404
         
         if not file_record.public_link_hash:
-            file_record.public_link_hash = hashlib.sha256(
-                f"{file_id}{datetime.now().isoformat()}{random.random()}".encode()
-            ).hexdigest()[:16]
+            file_record.public_link_hash = new_share_hash(file_id)
         
         file_record.is_public = True
         db.session.commit()
+        share_cache.invalidate(file_record.public_link_hash)
         
         return jsonify({'success': True, 'share_link': f"/share/{file_record.public_link_hash}"})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+# ==================== BULK ====================
+
+@api.route('/api/files/bulk-delete', methods=['POST'])
+@token_required
+def bulk_delete(user):
+    """Delete many files in one transaction, storage messages go in batched deleteMessages calls"""
+    try:
+        ids = get_bulk_ids()
+        if ids is None:
+            return jsonify({'success': False, 'error': f'ids required (at most {Config.BULK_MAX_ITEMS})'}), 400
+        
+        files = File.query.filter(File.user_id == user.id, File.id.in_(ids)).all()
+        results = bulk_results(ids, files)
+        
+        forget = remove_files(user, files)
+        db.session.commit()
+        forget()
+        
+        return jsonify({'success': True, 'deleted': len(files), 'results': results})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@api.route('/api/files/bulk-share', methods=['POST'])
+@identity_required
+def bulk_share(user):
+    try:
+        ids = get_bulk_ids()
+        if ids is None:
+            return jsonify({'success': False, 'error': f'ids required (at most {Config.BULK_MAX_ITEMS})'}), 400
+        
+        files = File.query.filter(File.user_id == user.id, File.id.in_(ids)).all()
+        for file_record in files:
+            if not file_record.public_link_hash:
+                file_record.public_link_hash = new_share_hash(file_record.id)
+            file_record.is_public = True
+        db.session.commit()
+        
+        for file_record in files:
+            share_cache.invalidate(file_record.public_link_hash)
+        
+        results = bulk_results(ids, files, share_link=lambda f: f"/share/{f.public_link_hash}")
+        return jsonify({'success': True, 'results': results})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@api.route('/api/files/bulk-unshare', methods=['POST'])
+@identity_required
+def bulk_unshare(user):
+    """Turn public links off (sharing again brings back the same link)"""
+    try:
+        ids = get_bulk_ids()
+        if ids is None:
+            return jsonify({'success': False, 'error': f'ids required (at most {Config.BULK_MAX_ITEMS})'}), 400
+        
+        files = File.query.filter(File.user_id == user.id, File.id.in_(ids)).all()
+        for file_record in files:
+            file_record.is_public = False
+        db.session.commit()
+        
+        for file_record in files:
+            if file_record.public_link_hash:
+                share_cache.invalidate(file_record.public_link_hash)
+        
+        return jsonify({'success': True, 'results': bulk_results(ids, files)})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@api.route('/api/files/upload-multiple', methods=['POST'])
+@token_required
+def upload_multiple(user):
+    """Several files ('files' fields) in one request, new content is sent to storage in parallel"""
+    staged = []
+    try:
+        uploads = [f for f in request.files.getlist('files') if f.filename]
+        if not uploads:
+            return jsonify({'success': False, 'error': 'No file'}), 400
+        if len(uploads) > Config.BULK_MAX_ITEMS:
+            return jsonify({'success': False, 'error': f'At most {Config.BULK_MAX_ITEMS} files'}), 400
+        
+        os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
+        for file in uploads:
+            secure_name = secure_filename(file.filename) or f"file_{uuid.uuid4().hex[:8]}"
+            file_path = os.path.join(Config.UPLOAD_FOLDER, f"{uuid.uuid4()}_{secure_name}")
+            file.save(file_path)
+            staged.append((file.filename, file_path))
+        
+        stored = store_files(user, staged)
+        db.session.commit()
+        
+        records = [r['file'] for r in stored if r['success']]
+        file_paths = resolve_file_paths([f for f in records if f.file_type == 'image'])
+        
+        results = []
+        for (original_filename, _), result in zip(staged, stored):
+            if not result['success']:
+                results.append({'filename': original_filename, 'success': False, 'error': result['error']})
+                continue
+            f = result['file']
+            fd = f.to_dict()
+            fd['download_count'] = 0
+            fd['preview_url'] = stream_link(f) if file_paths.get(f.telegram_file_id) else None
+            fd['thumbnail_url'] = thumbnail_link(f) if thumbnails.available(f) else None
+            results.append({'filename': original_filename, 'success': True, 'file': fd})
+        
+        return jsonify({'success': True, 'uploaded': len(records), 'results': results})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+    finally:
+        for _, file_path in staged:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+
 # ==================== USER ====================
 
-@app.route('/api/user/profile', methods=['GET'])
+@api.route('/api/user/profile', methods=['GET'])
 @token_required
 def get_profile(user):
     return jsonify({'success': True, 'user': user.to_dict()})
 
 
-@app.route('/api/user/storage', methods=['GET'])
+@api.route('/api/user/storage', methods=['GET'])
 @token_required
 def get_storage_stats(user):
     try:
-        files = File.query.filter_by(user_id=user.id).all()
-        
-        by_type = {}
-        for f in files:
-            ft = f.file_type or 'other'
-            if ft not in by_type:
-                by_type[ft] = {'count': 0, 'size': 0}
-            by_type[ft]['count'] += 1
-            by_type[ft]['size'] += f.file_size
+        stats = storage_stats.get(user)
         
         return jsonify({
             'success': True,
             'storage': {
-                'total_files': len(files),
+                'total_files': stats['total_files'],
                 'total_size': user.storage_used,
                 'total_size_formatted': format_file_size(user.storage_used),
-                'by_type': by_type
+                'by_type': stats['by_type']
             }
         })
     except Exception as e:
@@ -385,38 +1317,150 @@ def get_storage_stats(user):
 
 # ==================== PUBLIC ====================
 
-@app.route('/share/<hash>', methods=['GET'])
+@api.route('/share/<hash>', methods=['GET'])
 def public_file(hash):
     try:
-        file_record = File.query.filter_by(public_link_hash=hash, is_public=True).first()
-        if not file_record:
+        shared = get_shared_file(hash)
+        if not shared:
             return jsonify({'success': False, 'error': 'Not found'}), 404
         
-        url = get_cached_file_url(file_record.telegram_file_id)
-        if not url:
-            return jsonify({'success': False, 'error': 'File unavailable'}), 500
+        headers = {'ETag': f'"{file_etag(shared)}"', 'Cache-Control': f'public, max-age={Config.SHARE_MAX_AGE}'}
+        if request.if_none_match.contains(file_etag(shared)):
+            return Response(status=304, headers=headers)
         
-        file_record.download_count += 1
-        db.session.commit()
+        download_counter.increment(shared.id)
         
-        return jsonify({
+        response = jsonify({
             'success': True,
-            'file': {'filename': file_record.original_filename, 'size': file_record.file_size, 'download_url': url}
+            'file': {
+                'filename': shared.original_filename,
+                'size': shared.file_size,
+                'download_url': url_for('api.public_file_download', hash=hash, _external=True)
+            }
         })
+        response.headers.update(headers)
+        return response
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@api.route('/share/<hash>/download', methods=['GET'])
+def public_file_download(hash):
+    try:
+        shared = get_shared_file(hash)
+        if not shared:
+            return jsonify({'success': False, 'error': 'Not found'}), 404
+        
+        return stream_file_response(
+            shared,
+            as_attachment=request.args.get('download') == '1',
+            cache_control=f'public, max-age={Config.SHARE_MAX_AGE}'
+        )
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@webhook.route('/api/telegram/webhook', methods=['POST'])
+def telegram_webhook():
+    """Bot updates pushed by Telegram (TELEGRAM_UPDATE_MODE=webhook)"""
+    try:
+        if not telegram_handler.webhook_authorized(request.headers.get('X-Telegram-Bot-Api-Secret-Token')):
+            return jsonify({'success': False, 'error': 'Forbidden'}), 403
+        
+        update = request.get_json(silent=True)
+        if not update or 'update_id' not in update:
+            return jsonify({'success': False, 'error': 'Invalid update'}), 400
+        
+        telegram_handler.process_updates([update])
+        return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/health', methods=['GET'])
+@api.route('/api/health', methods=['GET'])
 def health():
     return jsonify({'success': True, 'status': 'healthy', 'version': '3.1.0'})
 
 
-@app.route('/')
+@api.route('/api/stats', methods=['GET'])
+def stats():
+    return jsonify({'success': True, 'stats': {
+        'telegram': telegram_handler.client.stats(),
+        'storage_shards': telegram_handler.shard_stats(),
+        'file_url_cache': file_url_cache.stats(),
+        'content_cache': content_cache.stats(),
+        'thumbnails': thumbnails.stats(),
+        'share_cache': share_cache.stats(),
+        'download_counter': download_counter.stats()
+    }})
+
+
+@api.route('/')
 def index():
     return jsonify({'message': 'Vimesta Cloud API v3.1', 'status': 'running'})
 
 
+@api.cli.command('reconcile-storage')
+def reconcile_storage():
+    """Rebuild storage counters and storage_used from the files table"""
+    checked, drifted = storage_stats.reconcile()
+    print(f"✅ Reconciled storage for {checked} users ({drifted} had drifted)")
+
+
+@api.cli.command('sweep-sessions')
+def sweep_sessions_command():
+    """Delete expired and revoked login sessions"""
+    print(f"✅ Removed {sweep_sessions()} sessions")
+
+
+@api.cli.command('rebuild-search-index')
+def rebuild_search_index():
+    """Rebuild the filename search index from the files table (run after VACUUM)"""
+    if not create_search_index(rebuild=True):
+        print("⚠️ No filename search index on this database, search uses LIKE")
+
+
+@api.cli.command('init-db')
+def init_db_command():
+    """Create missing tables, columns and indexes and import legacy data"""
+    init_db(current_app)
+    telegram_handler.import_phone_mapping()
+
+
+def start_services(app):
+    """Start the background work: bot updates, upload workers, counter flushing, session and upload cleanup"""
+    telegram_handler.start(app)
+    upload_queue.start(app, process_upload_job)
+    download_counter.start(app)
+    session_sweeper.start(app)
+    chunked_uploads.start(app)
+
+
+def create_app(config_object=Config, start=False):
+    """
+    Build the Flask app. Nothing touches the database, disk or network
+    here; run `flask init-db` for the schema and pass start=True (or call
+    start_services) in processes that should run the background work.
+    """
+    app = Flask(__name__)
+    app.config.from_object(config_object)
+    
+    # CORS
+    CORS(app, resources={r"/api/*": {"origins": "*"}}, supports_credentials=True)
+    
+    db.init_app(app)
+    app.register_blueprint(api)
+    if app.config['TELEGRAM_UPDATE_MODE'] == 'webhook':
+        # Updates bind phone numbers to chats, so the endpoint must only take Telegram's calls
+        if not app.config['TELEGRAM_WEBHOOK_SECRET']:
+            raise RuntimeError("TELEGRAM_WEBHOOK_SECRET is required with TELEGRAM_UPDATE_MODE=webhook")
+        app.register_blueprint(webhook)
+    
+    if start:
+        start_services(app)
+    return app
+
+
 if __name__ == '__main__':
     print("""
     ╔════════════════════════════════════════════════════════╗
@@ -428,4 +1472,11 @@ if __name__ == '__main__':
     ║  API: http://localhost:5000                            ║
     ╚════════════════════════════════════════════════════════╝
     """)
+    app = create_app()
+    with app.app_context():
+        init_db(app)
+        telegram_handler.import_phone_mapping()
+    # The reloader's parent process only watches files
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_services(app)
     app.run(debug=True, host='0.0.0.0', port=5000, threaded=True)
@@ -1,10 +1,24 @@
 import jwt
+import time
 import hashlib
 import hmac
+import itertools
+import threading
 from datetime import datetime, timedelta
 from functools import wraps
+from types import SimpleNamespace
 from flask import request, jsonify, current_app
 from models import db, User, Session
+from cache import TTLCache
+from config import Config
+
+# Verified tokens -> user snapshot
+auth_cache = TTLCache(Config.AUTH_CACHE_SIZE, Config.AUTH_CACHE_TTL)
+
+# Bumped by invalidate_user(), cached snapshots of an older generation are ignored.
+# An entry only matters while snapshots from before it can still be cached.
+_user_generations = TTLCache(Config.AUTH_CACHE_SIZE, Config.AUTH_CACHE_TTL)
+_generation_counter = itertools.count(1)
 
 def generate_token(user_id, telegram_id):
     """Generate JWT token for authenticated user"""
@@ -60,29 +74,78 @@ def verify_telegram_auth(auth_data):
     return True
 
 
+def get_request_token():
+    """Bearer token from the Authorization header"""
+    auth_header = request.headers.get('Authorization', '')
+    if auth_header.startswith('Bearer '):
+        return auth_header.split(' ')[1]
+    return None
+
+
+def user_snapshot(user):
+    return {
+        'id': user.id,
+        'telegram_id': user.telegram_id,
+        'telegram_username': user.telegram_username,
+        'first_name': user.first_name,
+        'last_name': user.last_name,
+        'phone_number': user.phone_number,
+        'account_type': user.account_type
+    }
+
+
+def authenticate(token):
+    """
+    Return (user snapshot, error) for a token. The session is checked on
+    every call, so a logout in any worker takes effect at once; only the
+    JWT decode and the user load are saved by auth_cache.
+    """
+    if not session_is_active(token):
+        auth_cache.invalidate(token)
+        return None, 'Session has ended'
+    
+    cached = auth_cache.get(token)
+    if cached and cached['generation'] == (_user_generations.get(cached['user']['id']) or 0):
+        return cached['user'], None
+    
+    payload = verify_token(token)
+    if not payload:
+        return None, 'Token is invalid or expired'
+    
+    generation = _user_generations.get(payload['user_id']) or 0
+    
+    user = db.session.get(User, payload['user_id'])
+    if not user:
+        return None, 'User not found'
+    
+    snapshot = user_snapshot(user)
+    ttl = min(Config.AUTH_CACHE_TTL, payload['exp'] - time.time())
+    if ttl > 0:
+        auth_cache.set(token, {'user': snapshot, 'generation': generation}, ttl=ttl)
+    return snapshot, None
+
+
+def invalidate_user(user_id):
+    """Drop cached snapshots of a user after the row changes"""
+    _user_generations.set(user_id, next(_generation_counter))
+
+
 def token_required(f):
     """Decorator to require valid JWT token for API endpoints"""
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = None
-        
-        # Get token from Authorization header
-        if 'Authorization' in request.headers:
-            auth_header = request.headers['Authorization']
-            if auth_header.startswith('Bearer '):
-                token = auth_header.split(' ')[1]
-        
+        token = get_request_token()
         if not token:
             return jsonify({'error': 'Token is missing', 'success': False}), 401
         
-        # Verify token
-        payload = verify_token(token)
-        if not payload:
-            return jsonify({'error': 'Token is invalid or expired', 'success': False}), 401
+        snapshot, error = authenticate(token)
+        if error:
+            return jsonify({'error': error, 'success': False}), 401
         
         # Get user from database
-        user = User.query.get(payload['user_id'])
+        user = db.session.get(User, snapshot['id'])
         if not user:
+            invalidate_user(snapshot['id'])
             return jsonify({'error': 'User not found', 'success': False}), 401
         
         # Pass user to the decorated function
@@ -91,11 +154,32 @@ def token_required(f):
     return decorated
 
 
+def identity_required(f):
+    """
+    Like token_required, but passes the cached user snapshot (id,
+    telegram_id, names, phone) instead of loading the User row.
+    For handlers that only need to know who the caller is.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        token = get_request_token()
+        if not token:
+            return jsonify({'error': 'Token is missing', 'success': False}), 401
+        
+        snapshot, error = authenticate(token)
+        if error:
+            return jsonify({'error': error, 'success': False}), 401
+        
+        return f(SimpleNamespace(**snapshot), *args, **kwargs)
+    
+    return decorated
+
+
 def create_session(user, token, request):
     """Create a new session record"""
     session = Session(
         user_id=user.id,
-        jwt_token=token,
+        token_hash=Session.hash_token(token),
         ip_address=request.remote_addr,
         user_agent=request.user_agent.string[:500] if request.user_agent else None,
         expires_at=datetime.utcnow() + timedelta(seconds=current_app.config['JWT_ACCESS_TOKEN_EXPIRES'])
@@ -105,11 +189,83 @@ def create_session(user, token, request):
     return session
 
 
+def sign_file_link(file_id, expires):
+    """HMAC signature for a time-limited file stream link"""
+    message = f"{file_id}:{expires}".encode()
+    return hmac.new(current_app.config['SECRET_KEY'].encode(), message, hashlib.sha256).hexdigest()
+
+
+def verify_file_link(file_id, expires, signature):
+    """Check a stream link signature and that it has not expired"""
+    try:
+        expires = int(expires)
+    except (TypeError, ValueError):
+        return False
+    if expires < datetime.utcnow().timestamp():
+        return False
+    return hmac.compare_digest(sign_file_link(file_id, expires), signature or '')
+
+
 def invalidate_session(token):
     """Invalidate a session"""
-    session = Session.query.filter_by(jwt_token=token, is_active=True).first()
-    if session:
-        session.is_active = False
-        db.session.commit()
-        return True
-    return False
+    auth_cache.invalidate(token)
+    revoked = Session.query.filter_by(token_hash=Session.hash_token(token), is_active=True).update(
+        {'is_active': False}, synchronize_session=False
+    )
+    db.session.commit()
+    return bool(revoked)
+
+
+def session_is_active(token):
+    """Indexed lookup by token digest, a token without a live session has been revoked"""
+    return db.session.query(
+        Session.query.filter(
+            Session.token_hash == Session.hash_token(token),
+            Session.is_active == True,
+            Session.expires_at > datetime.utcnow()
+        ).exists()
+    ).scalar()
+
+
+def sweep_sessions(batch_size=None):
+    """Delete expired and revoked sessions in batches, returns the number removed"""
+    batch_size = batch_size or Config.SESSION_SWEEP_BATCH
+    removed = 0
+    for condition in (Session.expires_at <= datetime.utcnow(), Session.is_active == False):
+        while True:
+            ids = [row.id for row in Session.query.with_entities(Session.id).filter(condition).limit(batch_size)]
+            if not ids:
+                break
+            Session.query.filter(Session.id.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+            removed += len(ids)
+            if len(ids) < batch_size:
+                break
+    return removed
+
+
+class SessionSweeper:
+    """Background thread that runs sweep_sessions() every SESSION_SWEEP_INTERVAL"""
+    
+    def __init__(self):
+        self._thread = None
+    
+    def start(self, app):
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, args=(app,), name='session-sweeper', daemon=True)
+        self._thread.start()
+    
+    def _run(self, app):
+        while True:
+            time.sleep(Config.SESSION_SWEEP_INTERVAL)
+            try:
+                with app.app_context():
+                    removed = sweep_sessions()
+                if removed:
+                    print(f"🧹 Removed {removed} expired sessions")
+            except Exception as e:
+                print(f"Session sweep failed: {e}")
+
+
+session_sweeper = SessionSweeper()
@@ -0,0 +1,51 @@
+"""
+Cold start benchmark: time for a fresh interpreter to import app.py and
+build the Flask app, i.e. what every worker, CLI command and test run pays.
+
+    python bench_startup.py [runs]
+"""
+import os
+import sys
+import subprocess
+import statistics
+import tempfile
+
+SNIPPET = r'''
+import time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+factory = getattr(app, 'create_app', None)
+if factory:
+    factory()
+t2 = time.perf_counter()
+print(f"{(t1 - t0) * 1000:.1f} {(t2 - t1) * 1000:.1f}")
+'''
+
+
+def run_once(env):
+    output = subprocess.run(
+        [sys.executable, '-c', SNIPPET], env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True, timeout=120, check=True
+    ).stdout.strip().splitlines()[-1]
+    import_ms, create_ms = (float(x) for x in output.split())
+    return import_ms, create_ms
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        env['PYTHONDONTWRITEBYTECODE'] = '1'
+        run_once(env)  # warm the OS file cache
+        samples = [run_once(env) for _ in range(runs)]
+
+    for label, values in (('import app', [s[0] for s in samples]), ('create_app()', [s[1] for s in samples])):
+        print(f"{label:<14} median {statistics.median(values):8.1f} ms   min {min(values):8.1f} ms")
+    total = [s[0] + s[1] for s in samples]
+    print(f"{'total':<14} median {statistics.median(total):8.1f} ms   min {min(total):8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
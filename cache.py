@@ -0,0 +1,192 @@
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+class _Flight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+
+
+class SQLiteCacheBackend:
+    """Cache entries in a local SQLite file so several worker processes share them"""
+
+    def __init__(self, path, table='cache'):
+        self.path = path
+        self.table = table
+        self._local = threading.local()
+        self._last_purge = 0
+        conn = self._conn()
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT, expires REAL)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_expires ON {table} (expires)")
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute(
+            f"SELECT value, expires FROM {self.table} WHERE key = ? AND expires > ?", (key, time.time())
+        ).fetchone()
+        if not row:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, value, expires):
+        conn = self._conn()
+        conn.execute(
+            f"INSERT OR REPLACE INTO {self.table} (key, value, expires) VALUES (?, ?, ?)",
+            (key, json.dumps(value), expires)
+        )
+        now = time.time()
+        if now - self._last_purge > 60:
+            self._last_purge = now
+            conn.execute(f"DELETE FROM {self.table} WHERE expires <= ?", (now,))
+
+    def delete(self, key):
+        self._conn().execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache with per-entry TTL.
+    get_or_load() collapses concurrent misses for a key into one loader
+    call, and refreshes entries in the background once they are older
+    than refresh_ahead * ttl so hot keys never expire under readers.
+    """
+
+    def __init__(self, max_entries, ttl, refresh_ahead=None, backend=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self.backend = backend
+        self._data = OrderedDict()  # key -> (value, stored_at, expires)
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._stats = {'hits': 0, 'misses': 0, 'loads': 0, 'refreshes': 0, 'evictions': 0, 'backend_hits': 0}
+
+    def _put(self, key, value, stored_at, expires):
+        self._data[key] = (value, stored_at, expires)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self._stats['evictions'] += 1
+
+    def get(self, key):
+        entry = self._lookup(key)
+        return entry[0] if entry else None
+
+    def _lookup(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry and entry[2] > now:
+                self._data.move_to_end(key)
+                self._stats['hits'] += 1
+                return entry
+            if entry:
+                del self._data[key]
+
+        if self.backend:
+            found = self.backend.get(key)
+            if found:
+                value, expires = found
+                entry = (value, expires - self.ttl, expires)
+                with self._lock:
+                    self._put(key, *entry)
+                    self._stats['backend_hits'] += 1
+                    self._stats['hits'] += 1
+                return entry
+
+        with self._lock:
+            self._stats['misses'] += 1
+        return None
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        expires = now + (ttl or self.ttl)
+        with self._lock:
+            self._put(key, value, now, expires)
+        if self.backend:
+            self.backend.set(key, value, expires)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+        if self.backend:
+            self.backend.delete(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def get_or_load(self, key, loader):
+        """Return the cached value, or call loader() once for all concurrent callers (None is not cached)"""
+        entry = self._lookup(key)
+        if entry:
+            value, stored_at, expires = entry
+            if self.refresh_ahead and time.time() - stored_at > self.ttl * self.refresh_ahead:
+                self._refresh_in_background(key, loader)
+            return value
+
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+
+        if not leader:
+            flight.event.wait()
+            return flight.value
+
+        try:
+            flight.value = self._load(key, loader)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.event.set()
+        return flight.value
+
+    def _load(self, key, loader):
+        with self._lock:
+            self._stats['loads'] += 1
+        value = loader()
+        if value is not None:
+            self.set(key, value)
+        return value
+
+    def _refresh_in_background(self, key, loader):
+        with self._lock:
+            if key in self._inflight:
+                return
+            flight = self._inflight[key] = _Flight()
+            self._stats['refreshes'] += 1
+
+        def refresh():
+            try:
+                flight.value = self._load(key, loader)
+            except Exception as e:
+                print(f"Cache refresh failed for {key}: {e}")
+            finally:
+                with self._lock:
+                    self._inflight.pop(key, None)
+                flight.event.set()
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._data)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 3) if lookups else 0
+        return stats
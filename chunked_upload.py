@@ -0,0 +1,183 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+
+from config import Config
+from models import db, UploadSession, UploadChunk
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class ChunkedUploadManager:
+    """
+    Resumable chunked uploads.
+    Each session owns one pre-sized data file; chunks are written at
+    their own offset so they can arrive in any order (or in parallel)
+    and a dropped client only re-sends the chunks that are missing.
+    A chunk is staged in full first, so a re-send that breaks off
+    never damages bytes that were already received.
+    """
+
+    def __init__(self):
+        self.folder = Config.CHUNK_UPLOAD_FOLDER
+        self.session_ttl = Config.CHUNK_SESSION_TTL
+        self.sweep_interval = Config.CHUNK_SWEEP_INTERVAL
+        self._last_sweep = 0
+        self._sweep_lock = threading.Lock()
+        self._thread = None
+
+    def start(self, app):
+        """Sweep abandoned uploads every CHUNK_SWEEP_INTERVAL in the background"""
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, args=(app,), name='chunk-sweeper', daemon=True)
+        self._thread.start()
+
+    def _run(self, app):
+        while True:
+            try:
+                with app.app_context():
+                    self.sweep(force=True)
+            except Exception as e:
+                print(f"Chunked upload sweep failed: {e}")
+            time.sleep(self.sweep_interval)
+
+    def data_path(self, upload_id):
+        return os.path.join(self.folder, f"{upload_id}.part")
+
+    def create_session(self, user, filename, total_size, chunk_size=None):
+        chunk_size = int(chunk_size or Config.CHUNK_SIZE)
+        if total_size <= 0:
+            return {'success': False, 'error': 'Invalid file size'}
+        if total_size > Config.MAX_CONTENT_LENGTH:
+            return {'success': False, 'error': 'File too large'}
+        if chunk_size <= 0 or chunk_size > Config.MAX_CHUNK_SIZE:
+            return {'success': False, 'error': 'Invalid chunk size'}
+
+        upload = UploadSession(
+            user_id=user.id,
+            filename=filename,
+            total_size=total_size,
+            chunk_size=chunk_size,
+            total_chunks=(total_size + chunk_size - 1) // chunk_size
+        )
+        db.session.add(upload)
+        db.session.flush()
+
+        # Sparse file of the final size, chunks are written in place
+        os.makedirs(self.folder, exist_ok=True)
+        with open(self.data_path(upload.id), 'wb') as f:
+            f.truncate(total_size)
+
+        db.session.commit()
+        return {'success': True, 'upload': upload}
+
+    def get_session(self, user, upload_id):
+        return UploadSession.query.filter_by(id=upload_id, user_id=user.id).first()
+
+    def write_chunk(self, upload, chunk_index, stream):
+        if chunk_index < 0 or chunk_index >= upload.total_chunks:
+            return {'success': False, 'error': 'Invalid chunk index'}
+
+        path = self.data_path(upload.id)
+        if not os.path.exists(path):
+            return {'success': False, 'error': 'Upload data missing'}
+
+        offset = chunk_index * upload.chunk_size
+        expected = min(upload.chunk_size, upload.total_size - offset)
+
+        written = 0
+        with tempfile.TemporaryFile(dir=self.folder) as staged:
+            while written <= expected:
+                data = stream.read(min(COPY_BUFFER_SIZE, expected + 1 - written))
+                if not data:
+                    break
+                if written + len(data) > expected:
+                    return {'success': False, 'error': 'Chunk too large'}
+                staged.write(data)
+                written += len(data)
+
+            if written != expected:
+                return {'success': False, 'error': f'Incomplete chunk ({written}/{expected} bytes)'}
+
+            # Only a complete chunk goes into the data file, re-sent ones overwrite the same bytes
+            staged.seek(0)
+            with open(path, 'r+b') as f:
+                f.seek(offset)
+                shutil.copyfileobj(staged, f, COPY_BUFFER_SIZE)
+
+        if not db.session.get(UploadChunk, (upload.id, chunk_index)):
+            db.session.add(UploadChunk(upload_id=upload.id, chunk_index=chunk_index, size=written))
+        upload.updated_at = datetime.utcnow()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Same chunk recorded concurrently by a parallel request
+            db.session.rollback()
+
+        return {'success': True, 'chunk_index': chunk_index, 'size': written}
+
+    def finish(self, upload):
+        """Return the assembled file path once every chunk has arrived"""
+        missing = upload.missing_chunks()
+        if missing:
+            return {'success': False, 'error': 'Upload incomplete', 'missing_chunks': missing}
+
+        path = self.data_path(upload.id)
+        if not os.path.exists(path) or os.path.getsize(path) != upload.total_size:
+            return {'success': False, 'error': 'Upload data missing'}
+
+        return {'success': True, 'file_path': path}
+
+    def discard(self, upload):
+        path = self.data_path(upload.id)
+        if os.path.exists(path):
+            os.remove(path)
+        db.session.delete(upload)
+        db.session.commit()
+
+    def sweep(self, force=False):
+        """Remove abandoned sessions (and orphaned data files), at most once per interval"""
+        now = time.time()
+        if not force and now - self._last_sweep < self.sweep_interval:
+            return 0
+        if not self._sweep_lock.acquire(blocking=False):
+            return 0
+
+        try:
+            self._last_sweep = now
+            cutoff = datetime.utcnow() - timedelta(seconds=self.session_ttl)
+            stale = UploadSession.query.filter(UploadSession.updated_at < cutoff).all()
+            for upload in stale:
+                self._remove(self.data_path(upload.id))
+                db.session.delete(upload)
+            db.session.commit()
+
+            if os.path.isdir(self.folder):
+                for name in os.listdir(self.folder):
+                    path = os.path.join(self.folder, name)
+                    try:
+                        if os.path.getmtime(path) < now - self.session_ttl:
+                            os.remove(path)
+                    except OSError:
+                        # Completed, discarded or swept by another process meanwhile
+                        pass
+
+            if stale:
+                print(f"🧹 Removed {len(stale)} abandoned uploads")
+            return len(stale)
+        finally:
+            self._sweep_lock.release()
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+chunked_uploads = ChunkedUploadManager()
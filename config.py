@@ -16,6 +16,28 @@ class Config:
     TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN', '8142851465:AAEASmmPeQQIkTSKyRY7LogY-jket5Qra5E')
     TELEGRAM_BOT_USERNAME = 'Vimesta_bot'
     
+    # Bot API HTTP transport
+    TELEGRAM_POOL_SIZE = int(os.getenv('TELEGRAM_POOL_SIZE', 20))
+    TELEGRAM_MAX_RETRIES = 3
+    TELEGRAM_BACKOFF_BASE = 0.5  # seconds, doubled per retry (with full jitter)
+    TELEGRAM_BACKOFF_MAX = 8
+    TELEGRAM_CONNECT_TIMEOUT = 5
+    TELEGRAM_TIMEOUTS = {
+        'default': 15,
+        'getUpdates': 40,  # long polling waits up to 30s
+        'sendDocument': 300,
+        'file': 60
+    }
+    
+    # Bot API rate limits (requests per second, burst)
+    TELEGRAM_GLOBAL_RATE = 30
+    TELEGRAM_CHAT_RATE = 1
+    TELEGRAM_CHAT_BURST = 3
+    TELEGRAM_GROUP_RATE = 20 / 60  # groups and channels, including the storage channel
+    TELEGRAM_GROUP_BURST = 20
+    TELEGRAM_MAX_RATE_LIMIT_RETRIES = 5
+    TELEGRAM_COALESCE_WINDOW = 2  # deletes due within this many seconds go out in the same batch
+    
     # PRIVATE STORAGE CHANNEL
     # Files will be uploaded here (hidden from users)
     # Set this to a private channel ID where bot is admin
@@ -23,14 +45,121 @@ class Config:
     # If not set, will use bot's own chat (first person who starts bot becomes storage)
     STORAGE_CHANNEL_ID = os.getenv('STORAGE_CHANNEL_ID', None)
     
+    # More storage shards, each a channel with its own bot (and so its own rate limits):
+    # "channel_id:bot_token,channel_id:bot_token". STORAGE_CHANNEL_ID with the main bot is
+    # shard 0, these are numbered 1, 2, ... in order, so only ever append to the list.
+    STORAGE_SHARDS = os.getenv('STORAGE_SHARDS', '')
+    
+    # Bot updates: 'polling' (one leader process long-polls getUpdates) or 'webhook'
+    TELEGRAM_UPDATE_MODE = os.getenv('TELEGRAM_UPDATE_MODE', 'polling')
+    TELEGRAM_WEBHOOK_URL = os.getenv('TELEGRAM_WEBHOOK_URL')  # public https URL of /api/telegram/webhook
+    TELEGRAM_WEBHOOK_SECRET = os.getenv('TELEGRAM_WEBHOOK_SECRET', '')  # required in webhook mode
+    TELEGRAM_POLL_TIMEOUT = 30
+    TELEGRAM_POLL_BATCH = 100
+    TELEGRAM_POLL_LEASE_TTL = 90  # must outlast one long poll plus handling its batch
+    
+    # Legacy phone registry, imported into the database once on startup
+    PHONE_MAPPING_FILE = os.getenv('PHONE_MAPPING_FILE', os.path.join(os.path.dirname(__file__), 'phone_mapping.json'))
+    
     # JWT Configuration
     JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', 'vimesta-jwt-secret-2024')
     JWT_ACCESS_TOKEN_EXPIRES = 86400 * 7  # 7 days
     
+    # Login codes ('database' is shared by all workers, 'memory' is per process)
+    OTP_STORE = os.getenv('OTP_STORE', 'database')
+    OTP_TTL = 300
+    OTP_MAX_ATTEMPTS = 3
+    OTP_RESEND_INTERVAL = 60  # seconds between codes for one phone
+    OTP_MAX_REQUESTS = 5  # codes per phone per window
+    OTP_REQUEST_WINDOW = 3600
+    OTP_SWEEP_INTERVAL = 600
+    
+    # Session cleanup
+    SESSION_SWEEP_INTERVAL = 3600
+    SESSION_SWEEP_BATCH = 1000
+    
+    # Authenticated user cache (per process, the TTL bounds how stale a snapshot can be in other
+    # workers; sessions are checked on every request regardless)
+    AUTH_CACHE_SIZE = 10000
+    AUTH_CACHE_TTL = 30
+    
     # File Upload Configuration
     MAX_CONTENT_LENGTH = 2 * 1024 * 1024 * 1024  # 2GB max file size
     UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'uploads')
+    STREAM_BLOCK_SIZE = 1024 * 1024  # 1MB blocks when piping uploads to Telegram
     ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'mp4', 'mp3', 'doc', 'docx', 'xlsx', 'zip', 'rar', 'webp'}
     
     # CORS Configuration
     CORS_ORIGINS = ['*']
+    
+    # File path cache
+    # Telegram file paths (from getFile) stay valid for at least an hour
+    FILE_URL_CACHE_SIZE = 10000
+    FILE_URL_CACHE_TTL = 3000
+    FILE_URL_CACHE_REFRESH_AHEAD = 0.8  # refresh in background after 80% of the TTL
+    FILE_URL_CACHE_DB = os.getenv('FILE_URL_CACHE_DB')  # SQLite file shared by all workers (optional)
+    
+    # Download proxy
+    STREAM_LINK_TTL = int(os.getenv('STREAM_LINK_TTL', 3600))  # signed stream links live 1-2x this
+    
+    # Content cache for hot files (0 bytes disables it)
+    CONTENT_CACHE_FOLDER = os.getenv('CONTENT_CACHE_FOLDER', os.path.join(os.path.dirname(__file__), 'content_cache'))
+    CONTENT_CACHE_MAX_BYTES = int(os.getenv('CONTENT_CACHE_MAX_BYTES', 1024 * 1024 * 1024))  # 1GB
+    CONTENT_CACHE_MAX_FILE_SIZE = 20 * 1024 * 1024  # Bot API getFile limit
+    
+    # Thumbnails: Telegram's own, or scaled down locally if Pillow is installed
+    THUMBNAIL_SIZE = 320  # longest side of generated thumbnails
+    THUMBNAIL_SOURCE_MAX_SIZE = 20 * 1024 * 1024  # largest image scaled down locally
+    THUMBNAIL_CACHE_FOLDER = os.getenv('THUMBNAIL_CACHE_FOLDER', os.path.join(os.path.dirname(__file__), 'thumbnail_cache'))
+    THUMBNAIL_CACHE_MAX_BYTES = int(os.getenv('THUMBNAIL_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+    THUMBNAIL_LINK_TTL = 86400 * 7  # thumbnail links (and browser caching) stay the same for a week
+    
+    # Public share links
+    SHARE_CACHE_SIZE = 10000
+    SHARE_CACHE_TTL = 60  # bounds how long other workers may serve a deleted share
+    SHARE_MAX_AGE = 60  # Cache-Control max-age for browsers and reverse proxies
+    
+    # Download counters (write-behind)
+    DOWNLOAD_COUNTER_FLUSH_INTERVAL = 5  # seconds
+    DOWNLOAD_COUNTER_FLUSH_THRESHOLD = 1000  # files with pending increments
+    
+    # File listing
+    FILES_PAGE_SIZE = 100
+    FILES_MAX_PAGE_SIZE = 500
+    
+    # Filename search
+    SEARCH_PAGE_SIZE = 50
+    SEARCH_MAX_OFFSET = 1000  # deeper pages cost a full ranking each, refine the query instead
+    SEARCH_MAX_TERMS = 10
+    
+    # Preview URL resolution
+    PREVIEW_WORKERS = 8
+    PREVIEW_DEADLINE = 2  # seconds a listing waits for previews before returning nulls
+    PREVIEW_BATCH_LIMIT = 200
+    
+    # Chunked Upload Configuration
+    CHUNK_UPLOAD_FOLDER = os.path.join(UPLOAD_FOLDER, 'chunks')
+    CHUNK_SIZE = 10 * 1024 * 1024  # 10MB, same as ChunkUploader in upload.js
+    MAX_CHUNK_SIZE = 50 * 1024 * 1024
+    CHUNK_SESSION_TTL = 86400  # abandoned upload sessions are removed after 24h
+    CHUNK_SWEEP_INTERVAL = 600
+    
+    # Striping: larger files are stored as several messages of at most one part
+    STRIPE_PART_SIZE = int(os.getenv('STRIPE_PART_SIZE', 19 * 1024 * 1024))  # below the 20MB getFile limit
+    STRIPE_UPLOAD_WORKERS = 4  # parts of one file sent in parallel
+    STRIPE_DOWNLOAD_WORKERS = 8
+    STRIPE_DOWNLOAD_AHEAD = 2  # parts fetched (to temp files) while the current one streams
+    
+    # Bulk file operations
+    BULK_MAX_ITEMS = 1000  # file ids (or uploaded files) per request
+    BULK_UPLOAD_WORKERS = 4  # files of one multi-upload sent in parallel
+    
+    # Upload Job Queue
+    UPLOAD_JOB_FOLDER = os.path.join(UPLOAD_FOLDER, 'jobs')
+    UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', 4))
+    UPLOAD_JOB_POLL_INTERVAL = 2
+    UPLOAD_WORKER_HEARTBEAT = 30  # async uploads are refused once no worker has checked in for 3x this
+    UPLOAD_JOB_MAX_ATTEMPTS = 3
+    UPLOAD_JOB_RETRY_DELAY = 30  # seconds, multiplied by the attempt number
+    UPLOAD_JOB_STALE_AFTER = 600  # running jobs without progress for this long are requeued
+    UPLOAD_JOB_RETENTION = 86400 * 7
@@ -0,0 +1,194 @@
+import os
+import time
+import uuid
+import hashlib
+import threading
+
+from config import Config
+
+TMP_MAX_AGE = 3600  # seconds before an unfinished fill is considered abandoned
+
+
+class _Fill:
+    def __init__(self):
+        self.event = threading.Event()
+        self.path = None
+
+
+class ContentCache:
+    """
+    On-disk LRU cache of file contents with a byte budget.
+    Entries are keyed by telegram_file_id (whose content never changes).
+    A miss is filled by one fetch while concurrent readers of the same
+    file wait for it; fills go to a temp file that is renamed into place,
+    so readers never see a partial file. The folder itself is the index:
+    reads bump a file's mtime and every fill re-reads the folder before
+    evicting, so all worker processes share one budget and one LRU order.
+    """
+
+    def __init__(self, folder=None, max_bytes=None, max_file_size=None):
+        self.folder = folder or Config.CONTENT_CACHE_FOLDER
+        self.max_bytes = Config.CONTENT_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.max_file_size = Config.CONTENT_CACHE_MAX_FILE_SIZE if max_file_size is None else max_file_size
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._stats = {'hits': 0, 'misses': 0, 'fills': 0, 'fill_errors': 0, 'evictions': 0, 'bytes_saved': 0}
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _name(self, key):
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def _path(self, name):
+        return os.path.join(self.folder, name)
+
+    def _scan(self):
+        """Entries on disk (from every process) as [(mtime, name, size)], least recently used first"""
+        os.makedirs(self.folder, exist_ok=True)
+        now = time.time()
+        found = []
+        for name in os.listdir(self.folder):
+            path = self._path(name)
+            try:
+                stat = os.stat(path)
+                if name.endswith('.tmp'):
+                    # Fills in progress are left alone, ones abandoned by a crash are removed
+                    if stat.st_mtime < now - TMP_MAX_AGE:
+                        os.remove(path)
+                    continue
+            except FileNotFoundError:
+                continue
+            found.append((stat.st_mtime, name, stat.st_size))
+        found.sort()
+        return found
+
+    def cacheable(self, size):
+        if size is None:
+            # Small generated content, whose size is only known once made
+            return self.enabled
+        return self.enabled and 0 < size <= min(self.max_file_size, self.max_bytes)
+
+    def get(self, key):
+        """Path of the cached content, or None"""
+        if not self.enabled:
+            return None
+        path = self._path(self._name(key))
+        try:
+            # mtime is the LRU order, shared by every process using the folder
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self._stats['hits'] += 1
+        return path
+
+    def get_or_fill(self, key, size, fetch):
+        """
+        Return (path, fetched): the cached path, filled with fetch() (an
+        iterator of bytes, or None) on a miss, and whether this call went
+        to Telegram for it. The path is None if the file isn't cacheable
+        or the fill failed; the caller then serves it uncached.
+        """
+        path = self.get(key)
+        if path or not self.cacheable(size):
+            return path, False
+
+        name = self._name(key)
+        with self._lock:
+            fill = self._inflight.get(name)
+            leader = fill is None
+            if leader:
+                fill = self._inflight[name] = _Fill()
+                self._stats['misses'] += 1
+            else:
+                # Served by someone else's fetch
+                self._stats['hits'] += 1
+
+        if not leader:
+            fill.event.wait()
+            return fill.path, False
+
+        try:
+            fill.path = self._fill(name, size, fetch)
+        finally:
+            with self._lock:
+                self._inflight.pop(name, None)
+            fill.event.set()
+        return fill.path, True
+
+    def _fill(self, name, size, fetch):
+        path = self._path(name)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            blocks = fetch()
+            if blocks is None:
+                raise IOError('fetch failed')
+            written = 0
+            os.makedirs(self.folder, exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                for block in blocks:
+                    f.write(block)
+                    written += len(block)
+            if size is not None and written != size:
+                raise IOError(f'expected {size} bytes, got {written}')
+            os.replace(tmp_path, path)
+        except Exception as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            with self._lock:
+                self._stats['fill_errors'] += 1
+            print(f"Content cache fill failed: {e}")
+            return None
+
+        with self._lock:
+            self._stats['fills'] += 1
+            self._evict(keep=name)
+        return path
+
+    def _evict(self, keep=None):
+        """Remove the least recently used entries until the whole folder fits the budget"""
+        found = self._scan()
+        total = sum(size for _, _, size in found)
+        evicted = 0
+        for _, name, size in found:
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            try:
+                # Readers that already opened it keep their handle
+                os.remove(self._path(name))
+                evicted += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._stats['evictions'] += evicted
+
+    def invalidate(self, key):
+        if not self.enabled:
+            return
+        try:
+            os.remove(self._path(self._name(key)))
+        except FileNotFoundError:
+            pass
+
+    def record_served(self, nbytes):
+        """Bytes answered from disk instead of Telegram"""
+        with self._lock:
+            self._stats['bytes_saved'] += nbytes
+
+    def stats(self):
+        found = self._scan() if self.enabled else []
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(found)
+            stats['bytes'] = sum(size for _, _, size in found)
+            stats['max_bytes'] = self.max_bytes
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 3) if lookups else 0
+        return stats
+
+
+content_cache = ContentCache()
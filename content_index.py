@@ -0,0 +1,115 @@
+import hashlib
+
+from models import db, ContentBlob, FilePart, upsert
+
+
+class ContentIndex:
+    """
+    Per-user index of stored content by SHA-256.
+    Files with the same digest share one storage message; ref_count is the
+    number of File rows using it, and the message is only deleted once the
+    last of them is gone. Digests are scoped to the user, so knowing a hash
+    never gives access to someone else's file.
+    """
+
+    def hash_file(self, path):
+        with open(path, 'rb') as f:
+            return hashlib.file_digest(f, 'sha256').hexdigest()
+
+    def acquire(self, user_id, sha256):
+        """Add a reference to stored content, returns its blob or None if the user has no such content"""
+        updated = ContentBlob.query.filter(
+            ContentBlob.user_id == user_id,
+            ContentBlob.sha256 == sha256,
+            ContentBlob.ref_count > 0
+        ).update({'ref_count': ContentBlob.ref_count + 1}, synchronize_session=False)
+        if not updated:
+            return None
+        return db.session.get(ContentBlob, (user_id, sha256), populate_existing=True)
+
+    def register(self, user_id, result, file_size):
+        """
+        Index content just uploaded (result of upload_*_hidden) with one reference.
+        If the same content was stored meanwhile, that copy gets the reference
+        and is returned instead; the caller deletes the message it uploaded.
+        """
+        upsert(
+            ContentBlob,
+            {
+                'user_id': user_id,
+                'sha256': result['sha256'],
+                'telegram_file_id': result['file_id'],
+                'telegram_message_id': result.get('message_id'),
+                'file_size': file_size,
+                'part_count': result.get('part_count'),
+                'shard': result.get('shard'),
+                'thumb_file_id': result.get('thumb_file_id'),
+                'thumb_size': result.get('thumb_size'),
+                'ref_count': 1
+            },
+            {'ref_count': ContentBlob.ref_count + 1}
+        )
+        blob = db.session.get(ContentBlob, (user_id, result['sha256']), populate_existing=True)
+        if blob.telegram_file_id == result['file_id']:
+            self.add_parts(result)
+        return blob
+
+    def add_parts(self, result):
+        """Record the parts of a striped upload"""
+        for part in result.get('parts') or []:
+            db.session.add(FilePart(
+                stripe_id=result['file_id'],
+                part_index=part['part_index'],
+                telegram_file_id=part['file_id'],
+                telegram_message_id=part['message_id'],
+                offset=part['offset'],
+                size=part['size']
+            ))
+
+    def get_parts(self, file_record):
+        """Parts of a striped file in order, or None for a file stored as one message"""
+        if not file_record.part_count:
+            return None
+        return FilePart.query.filter_by(stripe_id=file_record.telegram_file_id).order_by(FilePart.part_index).all()
+
+    def discard(self, file_record):
+        """Forget the storage of content nothing references anymore, returns its [(telegram_file_id, message_id)]"""
+        parts = self.get_parts(file_record)
+        if not parts:
+            return [(file_record.telegram_file_id, file_record.telegram_message_id)]
+        FilePart.query.filter_by(stripe_id=file_record.telegram_file_id).delete(synchronize_session=False)
+        return [(part.telegram_file_id, part.telegram_message_id) for part in parts]
+
+    def release(self, file_record):
+        """Drop the file's reference, returns True when its storage message is no longer used"""
+        if not file_record.sha256:
+            return True
+        blob = db.session.get(ContentBlob, (file_record.user_id, file_record.sha256), populate_existing=True)
+        if not blob or blob.telegram_file_id != file_record.telegram_file_id:
+            # File from before the index, it owns its message
+            return True
+
+        key = {'user_id': file_record.user_id, 'sha256': file_record.sha256}
+        ContentBlob.query.filter_by(**key).update(
+            {'ref_count': ContentBlob.ref_count - 1}, synchronize_session=False
+        )
+        removed = ContentBlob.query.filter_by(**key).filter(
+            ContentBlob.ref_count <= 0
+        ).delete(synchronize_session=False)
+        return bool(removed)
+
+    @staticmethod
+    def as_result(blob):
+        """Stored content in the shape of an upload result, for create_file_record()"""
+        return {
+            'file_id': blob.telegram_file_id,
+            'message_id': blob.telegram_message_id,
+            'sha256': blob.sha256,
+            'part_count': blob.part_count,
+            'shard': blob.shard,
+            'thumb_file_id': blob.thumb_file_id,
+            'thumb_size': blob.thumb_size
+        }
+
+
+content_index = ContentIndex()
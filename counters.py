@@ -0,0 +1,114 @@
+import atexit
+import threading
+from flask import current_app
+from sqlalchemy import bindparam
+
+from config import Config
+from models import db, File
+
+
+class DownloadCounter:
+    """
+    Write-behind download counts.
+    Increments are summed per file in memory and written with one batched
+    UPDATE every flush interval (or once enough are pending), and again at
+    shutdown, so a download never waits on a write transaction. The flush
+    thread starts with the services, or with the first increment in a
+    process that didn't start them.
+    """
+
+    def __init__(self):
+        self.app = None
+        self._pending = {}
+        self._flushing = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats = {'increments': 0, 'flushes': 0, 'rows_written': 0, 'flush_errors': 0}
+
+    def start(self, app):
+        with self._start_lock:
+            if self._thread:
+                return
+            self.app = app
+            self._thread = threading.Thread(target=self._run, name='download-counter', daemon=True)
+            self._thread.start()
+            atexit.register(self._flush_at_exit)
+
+    def increment(self, file_id, amount=1):
+        if self._thread is None:
+            self.start(current_app._get_current_object())
+        with self._lock:
+            self._pending[file_id] = self._pending.get(file_id, 0) + amount
+            self._stats['increments'] += amount
+            full = len(self._pending) >= Config.DOWNLOAD_COUNTER_FLUSH_THRESHOLD
+        if full:
+            self._wakeup.set()
+
+    def count(self, file_record):
+        """Stored count plus increments not written yet"""
+        with self._lock:
+            pending = self._pending.get(file_record.id, 0) + self._flushing.get(file_record.id, 0)
+        return (file_record.download_count or 0) + pending
+
+    def flush(self):
+        """Write pending increments, returns the number of files updated"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._flushing = batch
+            if not batch:
+                return 0
+
+            table = File.__table__
+            stmt = table.update().where(table.c.id == bindparam('file_id')).values(
+                download_count=db.func.coalesce(table.c.download_count, 0) + bindparam('delta')
+            )
+            try:
+                db.session.execute(stmt, [{'file_id': k, 'delta': v} for k, v in batch.items()])
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                # Keep the increments for the next flush
+                with self._lock:
+                    for file_id, delta in batch.items():
+                        self._pending[file_id] = self._pending.get(file_id, 0) + delta
+                    self._stats['flush_errors'] += 1
+                print(f"Download counter flush failed: {e}")
+                return 0
+            finally:
+                with self._lock:
+                    self._flushing = {}
+
+            with self._lock:
+                self._stats['flushes'] += 1
+                self._stats['rows_written'] += len(batch)
+            return len(batch)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(Config.DOWNLOAD_COUNTER_FLUSH_INTERVAL)
+            self._wakeup.clear()
+            try:
+                with self.app.app_context():
+                    self.flush()
+            except Exception as e:
+                print(f"Download counter error: {e}")
+
+    def _flush_at_exit(self):
+        try:
+            with self.app.app_context():
+                self.flush()
+        except Exception as e:
+            print(f"Download counter final flush failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = sum(self._pending.values())
+        return stats
+
+
+download_counter = DownloadCounter()
@@ -1,5 +1,8 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
 from datetime import datetime
+import hashlib
 import uuid
 
 db = SQLAlchemy()
@@ -37,6 +40,11 @@ class User(db.Model):
 
 class File(db.Model):
     __tablename__ = 'files'
+    __table_args__ = (
+        # Listing by user (optionally by type), newest first, keyset on (upload_date, id)
+        db.Index('ix_files_user_date', 'user_id', 'upload_date', 'id'),
+        db.Index('ix_files_user_type_date', 'user_id', 'file_type', 'upload_date', 'id'),
+    )
     
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     user_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
@@ -50,6 +58,11 @@ class File(db.Model):
     is_public = db.Column(db.Boolean, default=False)
     public_link_hash = db.Column(db.String(64), nullable=True, unique=True)
     download_count = db.Column(db.Integer, default=0)
+    sha256 = db.Column(db.String(64), nullable=True)
+    part_count = db.Column(db.Integer, nullable=True)  # set when stored as FileParts
+    shard = db.Column(db.Integer, nullable=True)  # storage shard (channel and bot), None is shard 0
+    thumb_file_id = db.Column(db.String(200), nullable=True)  # thumbnail Telegram made for the document
+    thumb_size = db.Column(db.Integer, nullable=True)
     
     def to_dict(self):
         return {
@@ -61,28 +74,334 @@ class File(db.Model):
             'upload_date': self.upload_date.isoformat() if self.upload_date else None,
             'is_public': self.is_public,
             'public_link_hash': self.public_link_hash,
-            'download_count': self.download_count
+            'download_count': self.download_count,
+            'sha256': self.sha256
         }
 
 
+class ContentBlob(db.Model):
+    """One stored copy of a user's file content, shared by every File with the same SHA-256"""
+    __tablename__ = 'content_blobs'
+    
+    user_id = db.Column(db.String(36), db.ForeignKey('users.id'), primary_key=True)
+    sha256 = db.Column(db.String(64), primary_key=True)
+    telegram_file_id = db.Column(db.String(200), nullable=False)
+    telegram_message_id = db.Column(db.BigInteger, nullable=True)
+    file_size = db.Column(db.BigInteger, nullable=False, default=0)
+    part_count = db.Column(db.Integer, nullable=True)
+    shard = db.Column(db.Integer, nullable=True)
+    thumb_file_id = db.Column(db.String(200), nullable=True)
+    thumb_size = db.Column(db.Integer, nullable=True)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class FilePart(db.Model):
+    """
+    One message of a striped file. Parts are keyed by the telegram_file_id
+    the File rows carry (that of part 0), so files sharing content share parts.
+    """
+    __tablename__ = 'file_parts'
+    
+    stripe_id = db.Column(db.String(200), primary_key=True)
+    part_index = db.Column(db.Integer, primary_key=True)
+    telegram_file_id = db.Column(db.String(200), nullable=False)
+    telegram_message_id = db.Column(db.BigInteger, nullable=True)
+    offset = db.Column(db.BigInteger, nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+
+
+class StorageCounter(db.Model):
+    """Per-user, per-type file count and size, kept in step with uploads and deletes"""
+    __tablename__ = 'storage_counters'
+    
+    user_id = db.Column(db.String(36), db.ForeignKey('users.id'), primary_key=True)
+    file_type = db.Column(db.String(50), primary_key=True)
+    file_count = db.Column(db.BigInteger, nullable=False, default=0)
+    total_size = db.Column(db.BigInteger, nullable=False, default=0)
+
+
 class Session(db.Model):
-    __tablename__ = 'sessions'
+    """Login sessions, looked up by a digest of the JWT (the token itself is not stored)"""
+    __tablename__ = 'auth_sessions'
     
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     user_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
-    jwt_token = db.Column(db.Text, nullable=False)
+    token_hash = db.Column(db.String(64), nullable=False, unique=True)
     ip_address = db.Column(db.String(50), nullable=True)
     user_agent = db.Column(db.String(500), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    expires_at = db.Column(db.DateTime, nullable=False)
-    is_active = db.Column(db.Boolean, default=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    is_active = db.Column(db.Boolean, default=True, index=True)
     
     user = db.relationship('User', backref=db.backref('sessions', lazy='dynamic'))
+    
+    @staticmethod
+    def hash_token(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+
+class PhoneRegistration(db.Model):
+    """Phone numbers shared with the bot, mapped to the sender's Telegram chat"""
+    __tablename__ = 'phone_registrations'
+    
+    phone_number = db.Column(db.String(20), primary_key=True)
+    telegram_id = db.Column(db.BigInteger, nullable=False, index=True)
+    first_name = db.Column(db.String(100), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class BotState(db.Model):
+    """Small shared state: the getUpdates offset, the polling leader lease and the upload worker heartbeat"""
+    __tablename__ = 'bot_state'
+    
+    key = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.String(200), nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class OtpCode(db.Model):
+    """Pending login code per phone, plus the resend throttle window"""
+    __tablename__ = 'otp_codes'
+    
+    phone_number = db.Column(db.String(20), primary_key=True)
+    code = db.Column(db.String(10), nullable=True)
+    telegram_id = db.Column(db.BigInteger, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    last_sent_at = db.Column(db.DateTime, nullable=False)
+    window_start = db.Column(db.DateTime, nullable=False)
+    window_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class UploadSession(db.Model):
+    __tablename__ = 'upload_sessions'
+    
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
+    filename = db.Column(db.String(500), nullable=False)
+    total_size = db.Column(db.BigInteger, nullable=False)
+    chunk_size = db.Column(db.Integer, nullable=False)
+    total_chunks = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    chunks = db.relationship('UploadChunk', backref='upload', lazy='dynamic', cascade='all, delete-orphan')
+    
+    def received_chunks(self):
+        return sorted(c.chunk_index for c in self.chunks)
+    
+    def missing_chunks(self):
+        received = set(self.received_chunks())
+        return [i for i in range(self.total_chunks) if i not in received]
+    
+    def to_dict(self):
+        received = self.received_chunks()
+        received_set = set(received)
+        return {
+            'upload_id': self.id,
+            'filename': self.filename,
+            'total_size': self.total_size,
+            'chunk_size': self.chunk_size,
+            'total_chunks': self.total_chunks,
+            'received_chunks': received,
+            'missing_chunks': [i for i in range(self.total_chunks) if i not in received_set],
+            'complete': len(received) == self.total_chunks,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+
+class UploadChunk(db.Model):
+    __tablename__ = 'upload_chunks'
+    
+    upload_id = db.Column(db.String(36), db.ForeignKey('upload_sessions.id'), primary_key=True)
+    chunk_index = db.Column(db.Integer, primary_key=True)
+    size = db.Column(db.Integer, nullable=False)
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class UploadJob(db.Model):
+    __tablename__ = 'upload_jobs'
+    
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False, index=True)
+    filename = db.Column(db.String(500), nullable=False)
+    staged_path = db.Column(db.String(1000), nullable=False)
+    file_size = db.Column(db.BigInteger, default=0)
+    bytes_sent = db.Column(db.BigInteger, default=0)
+    status = db.Column(db.String(20), default='queued', index=True)  # queued, running, completed, failed
+    attempts = db.Column(db.Integer, default=0)
+    error = db.Column(db.Text, nullable=True)
+    file_id = db.Column(db.String(36), db.ForeignKey('files.id', ondelete='SET NULL'), nullable=True)
+    available_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'filename': self.filename,
+            'file_size': self.file_size,
+            'bytes_sent': self.bytes_sent,
+            'progress': round(100 * (self.bytes_sent or 0) / self.file_size) if self.file_size else 0,
+            'attempts': self.attempts,
+            'error': self.error,
+            'file_id': self.file_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+
+def upsert(model, values, update):
+    """
+    INSERT a row, or on a primary key conflict apply update (column -> value
+    or SQL expression; empty means keep the existing row). Runs in the
+    caller's transaction.
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(model).values(**values)
+        keys = [c.name for c in model.__table__.primary_key.columns]
+        if update:
+            stmt = stmt.on_conflict_do_update(index_elements=keys, set_=update)
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=keys)
+        db.session.execute(stmt)
+        return
+    
+    key = {c.name: values[c.name] for c in model.__table__.primary_key.columns}
+    if not model.query.filter_by(**key).first():
+        db.session.add(model(**values))
+    elif update:
+        model.query.filter_by(**key).update(update, synchronize_session=False)
+
+
+def upgrade_schema():
+    """Add columns and indexes that tables created by older versions are missing"""
+    inspector = db.inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            
+            columns = {c['name'] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns:
+                    column_type = column.type.compile(dialect=db.engine.dialect)
+                    default = f" DEFAULT {column.server_default.arg}" if column.server_default is not None else ""
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}{default}"))
+            
+            indexes = {ix['name'] for ix in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(conn)
+
+
+def migrate_legacy_sessions(batch_size=1000):
+    """Move live rows of the old sessions table (full JWT, unindexed) to auth_sessions and drop it"""
+    if not db.inspect(db.engine).has_table('sessions'):
+        return
+    
+    now = datetime.utcnow()
+    moved = 0
+    last_id = ''
+    with db.engine.begin() as conn:
+        while True:
+            batch = conn.execute(text(
+                "SELECT id, jwt_token FROM sessions WHERE id > :last_id AND is_active = :active "
+                "AND expires_at > :now ORDER BY id LIMIT :limit"
+            ), {'last_id': last_id, 'active': True, 'now': now, 'limit': batch_size}).fetchall()
+            if not batch:
+                break
+            conn.execute(text(
+                "INSERT INTO auth_sessions "
+                "(id, user_id, token_hash, ip_address, user_agent, created_at, expires_at, is_active) "
+                "SELECT id, user_id, :token_hash, ip_address, user_agent, created_at, expires_at, is_active "
+                "FROM sessions WHERE id = :id"
+            ), [{'id': row.id, 'token_hash': Session.hash_token(row.jwt_token)} for row in batch])
+            moved += len(batch)
+            last_id = batch[-1].id
+        conn.execute(text("DROP TABLE sessions"))
+    print(f"✅ Migrated {moved} active sessions")
+
+
+# Filename search (SQLite FTS5). External content: the index stores no copy of the
+# names, rows are matched to files by rowid. user_id is indexed so a query can be
+# limited to one user's files inside the index.
+SEARCH_INDEX = (
+    "CREATE VIRTUAL TABLE files_fts USING fts5("
+    "original_filename, user_id, content='files', content_rowid='rowid', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+)
+
+SEARCH_TRIGGERS = (
+    "CREATE TRIGGER IF NOT EXISTS files_fts_insert AFTER INSERT ON files BEGIN "
+    "INSERT INTO files_fts (rowid, original_filename, user_id) "
+    "VALUES (new.rowid, new.original_filename, new.user_id); END",
+    "CREATE TRIGGER IF NOT EXISTS files_fts_delete AFTER DELETE ON files BEGIN "
+    "INSERT INTO files_fts (files_fts, rowid, original_filename, user_id) "
+    "VALUES ('delete', old.rowid, old.original_filename, old.user_id); END",
+    "CREATE TRIGGER IF NOT EXISTS files_fts_update AFTER UPDATE OF original_filename, user_id ON files BEGIN "
+    "INSERT INTO files_fts (files_fts, rowid, original_filename, user_id) "
+    "VALUES ('delete', old.rowid, old.original_filename, old.user_id); "
+    "INSERT INTO files_fts (rowid, original_filename, user_id) "
+    "VALUES (new.rowid, new.original_filename, new.user_id); END"
+)
+
+
+def create_search_index(rebuild=False):
+    """
+    Create the filename search index and its sync triggers (SQLite with FTS5 only).
+    rebuild=True re-reads every file, needed after a VACUUM (which may renumber rowids).
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    
+    with db.engine.begin() as conn:
+        exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'files_fts'")).first()
+        if not exists:
+            try:
+                conn.execute(text(SEARCH_INDEX))
+            except OperationalError as e:
+                print(f"⚠️ Filename search index unavailable ({e}), search falls back to LIKE")
+                return False
+            rebuild = True
+        for trigger in SEARCH_TRIGGERS:
+            conn.execute(text(trigger))
+        if rebuild:
+            conn.execute(text("INSERT INTO files_fts (files_fts) VALUES ('rebuild')"))
+            print("✅ Filename search index built")
+    return True
+
+
+def build_storage_counters():
+    """Fill the new storage_counters table from the files table, so existing users start with their totals"""
+    with db.engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO storage_counters (user_id, file_type, file_count, total_size) "
+            "SELECT user_id, COALESCE(file_type, 'other'), COUNT(id), COALESCE(SUM(file_size), 0) "
+            "FROM files GROUP BY user_id, COALESCE(file_type, 'other')"
+        ))
+    print("✅ Storage counters built")
 
 
 def init_db(app):
-    """Initialize the database"""
-    db.init_app(app)
+    """Create missing tables, columns and indexes (flask init-db)"""
     with app.app_context():
+        # Counters are only adjusted from then on, so a new table has to start from the files already stored
+        has_counters = db.inspect(db.engine).has_table('storage_counters')
         db.create_all()
+        if not has_counters:
+            build_storage_counters()
+        upgrade_schema()
+        migrate_legacy_sessions()
+        create_search_index()
         print("✅ Database initialized!")
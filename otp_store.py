@@ -0,0 +1,209 @@
+import hmac
+import time
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import case
+from sqlalchemy.exc import IntegrityError
+
+from config import Config
+from models import db, OtpCode
+
+
+class DatabaseOTPStore:
+    """
+    OTP codes in the app database, so any worker can verify a code another
+    one issued. Attempt counting and resend throttling are single
+    conditional UPDATEs; expired rows are swept at most once per interval.
+    """
+
+    def __init__(self):
+        self._last_sweep = 0
+        self._sweep_lock = threading.Lock()
+
+    def issue(self, phone, code, telegram_id):
+        """Store a new code for phone, unless it was sent too recently"""
+        self.sweep()
+
+        now = datetime.utcnow()
+        resend_after = now - timedelta(seconds=Config.OTP_RESEND_INTERVAL)
+        window_start = now - timedelta(seconds=Config.OTP_REQUEST_WINDOW)
+        new_window = OtpCode.window_start <= window_start
+
+        updated = OtpCode.query.filter(
+            OtpCode.phone_number == phone,
+            OtpCode.last_sent_at <= resend_after,
+            new_window | (OtpCode.window_count < Config.OTP_MAX_REQUESTS)
+        ).update({
+            'code': code,
+            'telegram_id': telegram_id,
+            'attempts': 0,
+            'expires_at': now + timedelta(seconds=Config.OTP_TTL),
+            'last_sent_at': now,
+            'window_count': case((new_window, 1), else_=OtpCode.window_count + 1),
+            'window_start': case((new_window, now), else_=OtpCode.window_start)
+        }, synchronize_session=False)
+        db.session.commit()
+        if updated:
+            return {'success': True}
+
+        if not db.session.get(OtpCode, phone):
+            db.session.add(OtpCode(
+                phone_number=phone,
+                code=code,
+                telegram_id=telegram_id,
+                attempts=0,
+                expires_at=now + timedelta(seconds=Config.OTP_TTL),
+                last_sent_at=now,
+                window_start=now,
+                window_count=1
+            ))
+            try:
+                db.session.commit()
+                return {'success': True}
+            except IntegrityError:
+                # Another worker issued one for this phone at the same moment
+                db.session.rollback()
+
+        return self._throttled(db.session.get(OtpCode, phone), now)
+
+    def _throttled(self, row, now):
+        retry_after = Config.OTP_RESEND_INTERVAL
+        if row:
+            db.session.refresh(row)
+            waits = [(row.last_sent_at + timedelta(seconds=Config.OTP_RESEND_INTERVAL) - now).total_seconds()]
+            if row.window_count >= Config.OTP_MAX_REQUESTS:
+                waits.append((row.window_start + timedelta(seconds=Config.OTP_REQUEST_WINDOW) - now).total_seconds())
+            retry_after = max(waits)
+        return {'success': False, 'error': 'Too many requests', 'retry_after': max(1, int(retry_after))}
+
+    def verify(self, phone, code):
+        """Check a code, each call uses up one attempt; a match can only be used once"""
+        now = datetime.utcnow()
+        claimed = OtpCode.query.filter(
+            OtpCode.phone_number == phone,
+            OtpCode.code.isnot(None),
+            OtpCode.expires_at > now,
+            OtpCode.attempts < Config.OTP_MAX_ATTEMPTS
+        ).update({'attempts': OtpCode.attempts + 1}, synchronize_session=False)
+        db.session.commit()
+
+        row = db.session.get(OtpCode, phone)
+        if row:
+            db.session.refresh(row)
+        if not row or row.code is None or row.expires_at <= now:
+            return {'success': False, 'error': 'OTP expired'}
+        if not claimed:
+            self._clear(phone)
+            return {'success': False, 'error': 'Too many attempts'}
+
+        # Compared as bytes, compare_digest() refuses non-ASCII str
+        if not hmac.compare_digest(row.code.encode(), code.encode()):
+            return {'success': False, 'error': f'Invalid OTP. {Config.OTP_MAX_ATTEMPTS - row.attempts} left.'}
+
+        # Clearing the code (rather than deleting the row) keeps the throttle window
+        if not self._clear(phone, code):
+            return {'success': False, 'error': 'OTP expired'}
+        return {'success': True, 'telegram_id': row.telegram_id}
+
+    def _clear(self, phone, code=None):
+        query = OtpCode.query.filter(OtpCode.phone_number == phone, OtpCode.code.isnot(None))
+        if code is not None:
+            query = query.filter(OtpCode.code == code)
+        cleared = query.update({'code': None}, synchronize_session=False)
+        db.session.commit()
+        return cleared
+
+    def sweep(self, force=False):
+        """Delete rows whose code and throttle window have both run out"""
+        now = time.time()
+        if not force and now - self._last_sweep < Config.OTP_SWEEP_INTERVAL:
+            return 0
+        if not self._sweep_lock.acquire(blocking=False):
+            return 0
+
+        try:
+            self._last_sweep = now
+            cutoff = datetime.utcnow() - timedelta(seconds=Config.OTP_REQUEST_WINDOW)
+            removed = OtpCode.query.filter(
+                OtpCode.expires_at < cutoff,
+                OtpCode.window_start < cutoff
+            ).delete(synchronize_session=False)
+            db.session.commit()
+            return removed
+        finally:
+            self._sweep_lock.release()
+
+
+class MemoryOTPStore:
+    """Same behaviour as DatabaseOTPStore in a process-local dict (tests, single worker)"""
+
+    def __init__(self):
+        self._codes = {}
+        self._lock = threading.Lock()
+
+    def issue(self, phone, code, telegram_id):
+        now = time.time()
+        with self._lock:
+            self._sweep(now)
+            entry = self._codes.get(phone)
+            if entry:
+                if now - entry['window_start'] >= Config.OTP_REQUEST_WINDOW:
+                    entry['window_start'], entry['window_count'] = now, 0
+                waits = [entry['last_sent_at'] + Config.OTP_RESEND_INTERVAL - now]
+                if entry['window_count'] >= Config.OTP_MAX_REQUESTS:
+                    waits.append(entry['window_start'] + Config.OTP_REQUEST_WINDOW - now)
+                if max(waits) > 0:
+                    return {'success': False, 'error': 'Too many requests', 'retry_after': max(1, int(max(waits)))}
+            else:
+                entry = self._codes[phone] = {'window_start': now, 'window_count': 0}
+
+            entry.update({
+                'code': code,
+                'telegram_id': telegram_id,
+                'attempts': 0,
+                'expires_at': now + Config.OTP_TTL,
+                'last_sent_at': now,
+                'window_count': entry['window_count'] + 1
+            })
+        return {'success': True}
+
+    def verify(self, phone, code):
+        now = time.time()
+        with self._lock:
+            entry = self._codes.get(phone)
+            if not entry or entry['code'] is None or entry['expires_at'] <= now:
+                return {'success': False, 'error': 'OTP expired'}
+            if entry['attempts'] >= Config.OTP_MAX_ATTEMPTS:
+                entry['code'] = None
+                return {'success': False, 'error': 'Too many attempts'}
+
+            entry['attempts'] += 1
+            if not hmac.compare_digest(entry['code'].encode(), code.encode()):
+                return {'success': False, 'error': f"Invalid OTP. {Config.OTP_MAX_ATTEMPTS - entry['attempts']} left."}
+
+            entry['code'] = None
+            return {'success': True, 'telegram_id': entry['telegram_id']}
+
+    def _sweep(self, now):
+        for phone in [p for p, e in self._codes.items()
+                      if e['expires_at'] < now - Config.OTP_REQUEST_WINDOW
+                      and e['window_start'] < now - Config.OTP_REQUEST_WINDOW]:
+            del self._codes[phone]
+
+    def sweep(self, force=False):
+        with self._lock:
+            before = len(self._codes)
+            self._sweep(time.time())
+            return before - len(self._codes)
+
+
+def create_otp_store(kind=None):
+    kind = kind or Config.OTP_STORE
+    if kind == 'memory':
+        return MemoryOTPStore()
+    if kind == 'database':
+        return DatabaseOTPStore()
+    raise ValueError(f"Unknown OTP store: {kind}")
+
+
+otp_store = create_otp_store()
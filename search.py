@@ -0,0 +1,71 @@
+import re
+
+from sqlalchemy import text
+
+from config import Config
+from models import db, File
+
+SEARCH_SQL = """
+SELECT files.* FROM files_fts
+JOIN files ON files.rowid = files_fts.rowid
+WHERE files_fts MATCH :match AND files.user_id = :user_id{type_filter}
+ORDER BY bm25(files_fts, 1.0, 0.0), files.upload_date DESC
+LIMIT :limit OFFSET :offset
+"""
+
+
+class FileSearch:
+    """
+    Filename search over the files_fts index (SQLite FTS5).
+    Every word of the query must match the start of a word in the name,
+    best matches first. The index also holds user_id, so the match only
+    visits the user's own files. Without the index (other databases, or
+    SQLite built without FTS5) names are matched with LIKE instead.
+    """
+
+    def __init__(self):
+        self._indexed = None
+
+    def terms(self, query):
+        """Words of a query (letters and digits), at most SEARCH_MAX_TERMS"""
+        return re.findall(r'[^\W_]+', query or '')[:Config.SEARCH_MAX_TERMS]
+
+    def indexed(self):
+        """Whether the files_fts index exists (checked once per process)"""
+        if self._indexed is None:
+            self._indexed = db.engine.dialect.name == 'sqlite' and db.session.execute(
+                text("SELECT 1 FROM sqlite_master WHERE name = 'files_fts'")
+            ).first() is not None
+        return self._indexed
+
+    def search(self, user_id, terms, file_type=None, limit=Config.SEARCH_PAGE_SIZE, offset=0):
+        """The user's files matching all terms, returns up to limit + 1 (so callers can tell if there is more)"""
+        if self.indexed():
+            return self._match(user_id, terms, file_type, limit + 1, offset)
+        return self._like(user_id, terms, file_type, limit + 1, offset)
+
+    def _match(self, user_id, terms, file_type, limit, offset):
+        # Terms are letters and digits only, so they can be quoted as they are
+        match = ' AND '.join(
+            [f'user_id : "{user_id}"'] + [f'original_filename : "{term}" *' for term in terms]
+        )
+        params = {'match': match, 'user_id': user_id, 'limit': limit, 'offset': offset}
+        type_filter = ''
+        if file_type:
+            type_filter = ' AND files.file_type = :file_type'
+            params['file_type'] = file_type
+
+        statement = text(SEARCH_SQL.format(type_filter=type_filter)).bindparams(**params)
+        return db.session.execute(db.select(File).from_statement(statement)).scalars().all()
+
+    def _like(self, user_id, terms, file_type, limit, offset):
+        query = File.query.filter_by(user_id=user_id)
+        if file_type:
+            query = query.filter_by(file_type=file_type)
+        # Terms have no % or _ to escape
+        for term in terms:
+            query = query.filter(File.original_filename.ilike(f'%{term}%'))
+        return query.order_by(File.upload_date.desc(), File.id.desc()).offset(offset).limit(limit).all()
+
+
+file_search = FileSearch()
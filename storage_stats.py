@@ -0,0 +1,86 @@
+from sqlalchemy import func
+
+from models import db, User, File, StorageCounter, upsert
+
+
+class StorageStats:
+    """
+    Per-user storage totals by file type.
+    Counters are adjusted in the same transaction as the upload or
+    delete that changes them, so reading stats never scans the files
+    table; init-db fills them for files from before the counters, and
+    reconcile() rebuilds them from the files table if they drift.
+    """
+
+    def _increment(self, user_id, file_type, count_delta, size_delta):
+        upsert(
+            StorageCounter,
+            {'user_id': user_id, 'file_type': file_type, 'file_count': count_delta, 'total_size': size_delta},
+            {
+                'file_count': StorageCounter.file_count + count_delta,
+                'total_size': StorageCounter.total_size + size_delta
+            }
+        )
+
+    def file_added(self, file_record):
+        self._increment(file_record.user_id, file_record.file_type or 'other', 1, file_record.file_size or 0)
+
+    def file_removed(self, file_record):
+        self._increment(file_record.user_id, file_record.file_type or 'other', -1, -(file_record.file_size or 0))
+
+    def files_removed(self, file_records):
+        """file_removed() for many files, one counter update per type"""
+        totals = {}
+        for file_record in file_records:
+            entry = totals.setdefault((file_record.user_id, file_record.file_type or 'other'), [0, 0])
+            entry[0] += 1
+            entry[1] += file_record.file_size or 0
+        for (user_id, file_type), (count, size) in totals.items():
+            self._increment(user_id, file_type, -count, -size)
+
+    def get(self, user):
+        counters = StorageCounter.query.filter_by(user_id=user.id).all()
+        return {
+            'total_files': sum(c.file_count for c in counters),
+            'by_type': {c.file_type: {'count': c.file_count, 'size': c.total_size} for c in counters if c.file_count}
+        }
+
+    def reconcile_user(self, user):
+        """Rebuild the user's counters and storage_used from the files table, returns the storage_used drift"""
+        rows = db.session.query(
+            File.file_type, func.count(File.id), func.coalesce(func.sum(File.file_size), 0)
+        ).filter(File.user_id == user.id).group_by(File.file_type).all()
+
+        by_type = {}
+        for file_type, count, size in rows:
+            entry = by_type.setdefault(file_type or 'other', [0, 0])
+            entry[0] += count
+            entry[1] += size
+
+        StorageCounter.query.filter_by(user_id=user.id).delete(synchronize_session=False)
+        for file_type, (count, size) in by_type.items():
+            db.session.add(StorageCounter(user_id=user.id, file_type=file_type, file_count=count, total_size=size))
+
+        total_size = sum(size for _, size in by_type.values())
+        drift = (user.storage_used or 0) - total_size
+        user.storage_used = total_size
+        return drift
+
+    def reconcile(self, batch_size=500):
+        """Reconcile every user, one commit per batch; returns (users checked, users that had drifted)"""
+        checked = drifted = 0
+        last_id = ''
+        while True:
+            users = User.query.filter(User.id > last_id).order_by(User.id).limit(batch_size).all()
+            if not users:
+                break
+            for user in users:
+                if self.reconcile_user(user):
+                    drifted += 1
+            checked += len(users)
+            last_id = users[-1].id
+            db.session.commit()
+        return checked, drifted
+
+
+storage_stats = StorageStats()
@@ -0,0 +1,159 @@
+import time
+import random
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from config import Config
+from telegram_scheduler import RequestScheduler, DeferredCalls, PRIORITY_TRANSFER
+
+RETRY_STATUS_CODES = {500, 502, 503, 504}
+
+# Safe to repeat after a read timeout or 5xx ('file' is a file server download).
+# Anything else (sendMessage, sendDocument) may already have been carried out,
+# so it is only retried when it never reached Telegram.
+IDEMPOTENT_OPERATIONS = {
+    'file', 'getFile', 'getUpdates', 'getMe', 'deleteMessage', 'deleteMessages', 'setWebhook', 'deleteWebhook'
+}
+
+
+class TelegramClient:
+    """
+    Shared, thread-safe HTTP transport for the Bot API.
+    One pooled keep-alive session per bot token, per-operation timeouts
+    and retry with jittered exponential backoff on transient errors
+    (for sends, only errors that prove the request was not delivered).
+    Bot API calls are admitted by the bot's RequestScheduler.
+    """
+
+    def __init__(self, bot_token, pool_size=None, max_retries=None):
+        self.bot_token = bot_token
+        self.api_base = f"https://api.telegram.org/bot{bot_token}"
+        self.file_base = f"https://api.telegram.org/file/bot{bot_token}"
+        self.max_retries = Config.TELEGRAM_MAX_RETRIES if max_retries is None else max_retries
+
+        pool_size = pool_size or Config.TELEGRAM_POOL_SIZE
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+
+        self.scheduler = RequestScheduler()
+        self.deferred = DeferredCalls(self)
+
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'retries': 0, 'failures': 0, 'rate_limited': 0}
+
+    def timeout(self, operation):
+        read = Config.TELEGRAM_TIMEOUTS.get(operation, Config.TELEGRAM_TIMEOUTS['default'])
+        return (Config.TELEGRAM_CONNECT_TIMEOUT, read)
+
+    def file_url(self, file_path):
+        return f"{self.file_base}/{file_path}"
+
+    def call(self, method, data=None, params=None, body=None, headers=None, timeout=None,
+             chat_id=None, priority=PRIORITY_TRANSFER):
+        """
+        POST (or GET with params) a Bot API method and return the response.
+        chat_id is the chat the call acts on (for per-chat rate limits);
+        priority=None skips the scheduler (long polling).
+        """
+        url = f"{self.api_base}/{method}"
+        if params is not None:
+            return self._request('GET', url, method, chat_id, priority, params=params, timeout=timeout)
+        return self._request('POST', url, method, chat_id, priority,
+                             data=body if body is not None else data, headers=headers, timeout=timeout)
+
+    def download(self, file_path, headers=None, stream=True):
+        """GET a file from the Bot API file server (not rate limited)"""
+        return self._request('GET', self.file_url(file_path), 'file', None, None, headers=headers, stream=stream)
+
+    def _request(self, http_method, url, operation, chat_id, priority, timeout=None, **kwargs):
+        attempt = 0
+        rate_limited = 0
+        while True:
+            if priority is not None:
+                self.scheduler.acquire(chat_id, priority)
+            self._count('requests')
+            try:
+                response = self.session.request(
+                    http_method, url, timeout=timeout or self.timeout(operation), **kwargs
+                )
+                if response.status_code == 429:
+                    if rate_limited >= Config.TELEGRAM_MAX_RATE_LIMIT_RETRIES or not self._can_rewind(kwargs):
+                        return response
+                    rate_limited += 1
+                    self._count('rate_limited')
+                    retry_after = self._retry_after(response)
+                    response.close()
+                    # Every call to this chat is held back until retry_after has passed
+                    self.scheduler.penalize(chat_id, retry_after)
+                    if priority is None:
+                        time.sleep(retry_after)
+                    continue
+                if (response.status_code not in RETRY_STATUS_CODES or operation not in IDEMPOTENT_OPERATIONS
+                        or not self._can_retry(attempt, kwargs)):
+                    return response
+                response.close()
+            except (requests.ConnectionError, requests.Timeout) as e:
+                retryable = operation in IDEMPOTENT_OPERATIONS or self._not_sent(e)
+                if not retryable or not self._can_retry(attempt, kwargs):
+                    self._count('failures')
+                    raise
+
+            attempt += 1
+            self._count('retries')
+            time.sleep(self._backoff(attempt))
+
+    @staticmethod
+    def _not_sent(error):
+        """Whether the request failed while connecting, before Telegram could act on it"""
+        if isinstance(error, requests.ConnectTimeout):
+            return True
+        reason = getattr(error.args[0], 'reason', None) if error.args else None
+        return isinstance(reason, NewConnectionError)
+
+    def _retry_after(self, response):
+        try:
+            return float(response.json().get('parameters', {}).get('retry_after', 1))
+        except ValueError:
+            return float(response.headers.get('Retry-After', 1))
+
+    def _can_retry(self, attempt, kwargs):
+        if attempt >= self.max_retries:
+            return False
+        return self._can_rewind(kwargs)
+
+    def _can_rewind(self, kwargs):
+        # Streamed bodies can only be re-sent if they can start over
+        body = kwargs.get('data')
+        if body is not None and hasattr(body, '__iter__') and not isinstance(body, (dict, bytes, str)):
+            rewind = getattr(body, 'rewind', None)
+            return bool(rewind and rewind())
+        return True
+
+    def _backoff(self, attempt):
+        # Full jitter
+        ceiling = min(Config.TELEGRAM_BACKOFF_MAX, Config.TELEGRAM_BACKOFF_BASE * (2 ** attempt))
+        return random.uniform(0, ceiling)
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+
+        connections = 0
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                connections += pool.num_connections
+        stats['connections_opened'] = connections
+        stats['pool_size'] = self.adapter._pool_maxsize
+        stats['scheduler'] = self.scheduler.stats()
+        stats['deferred'] = self.deferred.stats()
+        return stats
@@ -1,52 +1,231 @@
 import os
+import hmac
+import atexit
 import json
 import time
+import uuid
+import socket
+import hashlib
+import itertools
 import threading
-import requests
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from flask import has_app_context
+from werkzeug.local import LocalProxy
 from config import Config
+from models import db, PhoneRegistration, BotState, upsert
+from telegram_scheduler import PRIORITY_AUTH, PRIORITY_TRANSFER, PRIORITY_BACKGROUND
+
+
+class MultipartStream:
+    """
+    multipart/form-data body that streams a file object in fixed-size blocks.
+    Size and SHA-256 of the file part are computed on the fly, so nothing
+    has to be buffered in memory or written to disk first.
+    """
+    
+    def __init__(self, fields, file_field, filename, fileobj, size=None, block_size=None, progress=None):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        self.fileobj = fileobj
+        self.size = size
+        self.block_size = block_size or Config.STREAM_BLOCK_SIZE
+        self.progress = progress
+        self.sha256 = hashlib.sha256()
+        self.bytes_read = 0
+        self._start = fileobj.tell() if self._seekable() else None
+        
+        head = []
+        for name, value in fields.items():
+            head.append(
+                f'--{self.boundary}\r\n'
+                f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+                f'{value}\r\n'
+            )
+        head.append(
+            f'--{self.boundary}\r\n'
+            f'Content-Disposition: form-data; name="{file_field}"; filename="{self._quote(filename)}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'
+        )
+        self._head = ''.join(head).encode('utf-8')
+        self._tail = f'\r\n--{self.boundary}--\r\n'.encode('utf-8')
+    
+    @staticmethod
+    def _quote(value):
+        return value.replace('\\', '\\\\').replace('"', '%22').replace('\r', '%0D').replace('\n', '%0A')
+    
+    def _seekable(self):
+        try:
+            return self.fileobj.seekable()
+        except (AttributeError, OSError):
+            return False
+    
+    def rewind(self):
+        """Start the body over for a retry, only possible for seekable files"""
+        if self._start is None:
+            return False
+        self.fileobj.seek(self._start)
+        self.sha256 = hashlib.sha256()
+        self.bytes_read = 0
+        return True
+    
+    def __len__(self):
+        # 0 makes requests fall back to chunked transfer encoding
+        if self.size is None:
+            return 0
+        return len(self._head) + self.size + len(self._tail)
+    
+    def __bool__(self):
+        # requests drops falsy bodies, even when they are streams
+        return True
+    
+    def __iter__(self):
+        yield self._head
+        while True:
+            data = self.fileobj.read(self.block_size)
+            if not data:
+                break
+            self.sha256.update(data)
+            self.bytes_read += len(data)
+            yield data
+            if self.progress:
+                self.progress(self.bytes_read)
+        yield self._tail
+
+
+class FileSlice:
+    """
+    File-like view of size bytes of fileobj, starting at offset (or, for a
+    stream, at its current position). digest, if given, is fed what is read.
+    """
+    
+    def __init__(self, fileobj, size, offset=None, digest=None, owns=False):
+        self.fileobj = fileobj
+        self.size = size
+        self.offset = offset
+        self.digest = digest
+        self.owns = owns
+        self.pos = 0
+        if offset is not None:
+            fileobj.seek(offset)
+    
+    def seekable(self):
+        return self.offset is not None
+    
+    def tell(self):
+        return self.pos
+    
+    def seek(self, pos):
+        self.fileobj.seek(self.offset + pos)
+        self.pos = pos
+    
+    def read(self, n=-1):
+        remaining = self.size - self.pos
+        if n is None or n < 0 or n > remaining:
+            n = remaining
+        data = self.fileobj.read(n) if n else b''
+        self.pos += len(data)
+        if self.digest:
+            self.digest.update(data)
+        return data
+    
+    def close(self):
+        if self.owns:
+            self.fileobj.close()
+
+
+class StorageShard:
+    """A storage channel and the bot that stores files in it (file_ids only work with that bot)"""
+    
+    def __init__(self, shard_id, client, channel_id=None):
+        self.id = shard_id
+        self.client = client
+        self.channel_id = channel_id
+        self.uploads = 0  # sendDocument calls in progress in this process
+        self.last_picked = 0
+
 
 class TelegramHandler:
     def __init__(self):
         self.bot_token = Config.TELEGRAM_BOT_TOKEN
-        self.api_base = f"https://api.telegram.org/bot{self.bot_token}"
         
-        # Phone to Telegram ID mapping
-        self.phone_mapping_file = os.path.join(os.path.dirname(__file__), 'phone_mapping.json')
-        self.phone_to_telegram = self._load_phone_mapping()
+        # Shared keep-alive connection pool for every Bot API call
+        # (imported here so processes that never call Telegram don't load requests)
+        from telegram_client import TelegramClient
+        self.client = TelegramClient(self.bot_token)
+        
+        # Flask app the update threads run in (set by start)
+        self.app = None
         
-        # Storage channel ID - use first registered user or config
-        self.storage_channel_id = self._get_initial_storage_channel()
+        # Storage channel ID - config, or the first registered user (looked up on first use)
+        self.storage_channel_id = int(Config.STORAGE_CHANNEL_ID) if Config.STORAGE_CHANNEL_ID else None
         
-        # Track last update ID for polling
-        self.last_update_id = 0
+        # Shard 0 is the storage channel above with the main bot, the rest come from STORAGE_SHARDS
+        self.shards = [StorageShard(0, self.client)]
+        for entry in filter(None, (s.strip() for s in Config.STORAGE_SHARDS.split(','))):
+            channel_id, token = entry.split(':', 1)
+            self.shards.append(StorageShard(len(self.shards), TelegramClient(token), int(channel_id)))
+        self._shard_lock = threading.Lock()
+        self._picks = itertools.count(1)
+        
+        # Polling: only the holder of the leader lease calls getUpdates
+        self.instance_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self.polling_thread = None
+    
+    def start(self, app):
+        """Start receiving bot updates (webhook registration or the polling thread)"""
+        self.app = app
+        with app.app_context():
+            self.get_storage_channel()
         
-        # Start polling in background
-        self.polling_thread = threading.Thread(target=self._poll_updates, daemon=True)
-        self.polling_thread.start()
-        print("✅ Telegram Bot polling started!")
+        if Config.TELEGRAM_UPDATE_MODE == 'webhook':
+            self.set_webhook()
+        elif self.polling_thread is None:
+            # Every process runs this, the lease decides which one polls
+            self.polling_thread = threading.Thread(target=self._poll_updates, daemon=True)
+            self.polling_thread.start()
+            atexit.register(self._release_lease)
+            print("✅ Telegram Bot polling started!")
         if self.storage_channel_id:
             print(f"📦 Storage channel: {self.storage_channel_id}")
+        if len(self.shards) > 1:
+            print(f"📦 Storage shards: {len(self.shards)}")
     
     def _get_initial_storage_channel(self):
         if Config.STORAGE_CHANNEL_ID:
             return int(Config.STORAGE_CHANNEL_ID)
-        if self.phone_to_telegram:
-            first_user = list(self.phone_to_telegram.values())[0]
-            return first_user.get('telegram_id')
-        return None
+        first = PhoneRegistration.query.order_by(PhoneRegistration.created_at).first()
+        return first.telegram_id if first else None
     
-    def _load_phone_mapping(self):
-        if os.path.exists(self.phone_mapping_file):
-            try:
-                with open(self.phone_mapping_file, 'r') as f:
-                    return json.load(f)
-            except:
-                return {}
-        return {}
-    
-    def _save_phone_mapping(self):
-        with open(self.phone_mapping_file, 'w') as f:
-            json.dump(self.phone_to_telegram, f)
+    def import_phone_mapping(self):
+        """One-shot import of phone_mapping.json, the file is renamed once its entries are in the table"""
+        path = Config.PHONE_MAPPING_FILE
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, 'r') as f:
+                mapping = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Could not read {path}: {e}")
+            return
+        
+        for phone, entry in mapping.items():
+            # Rows registered since the file was written win
+            upsert(PhoneRegistration, {
+                'phone_number': self._normalize_phone(phone),
+                'telegram_id': entry['telegram_id'],
+                'first_name': entry.get('first_name')
+            }, {})
+        db.session.commit()
+        
+        try:
+            os.replace(path, f"{path}.imported")
+        except FileNotFoundError:
+            # Another worker imported it at the same time
+            pass
+        print(f"📱 Imported {len(mapping)} phone registrations")
     
     def _normalize_phone(self, phone):
         phone = ''.join(filter(lambda x: x.isdigit() or x == '+', str(phone)))
@@ -59,16 +238,22 @@ class TelegramHandler:
         return '+' + phone
     
     def get_telegram_id_by_phone(self, phone):
-        phone = self._normalize_phone(phone)
-        return self.phone_to_telegram.get(phone)
+        registration = db.session.get(PhoneRegistration, self._normalize_phone(phone))
+        if not registration:
+            return None
+        return {'telegram_id': registration.telegram_id, 'first_name': registration.first_name}
     
     def register_phone(self, phone, telegram_id, first_name=''):
         phone = self._normalize_phone(phone)
-        self.phone_to_telegram[phone] = {
+        now = datetime.utcnow()
+        upsert(PhoneRegistration, {
+            'phone_number': phone,
             'telegram_id': telegram_id,
-            'first_name': first_name
-        }
-        self._save_phone_mapping()
+            'first_name': first_name,
+            'created_at': now,
+            'updated_at': now
+        }, {'telegram_id': telegram_id, 'first_name': first_name, 'updated_at': now})
+        db.session.commit()
         print(f"📱 Registered: {phone} -> {telegram_id}")
         
         if not self.storage_channel_id:
@@ -76,26 +261,138 @@ class TelegramHandler:
             print(f"📦 Storage: {telegram_id}")
     
     def get_storage_channel(self):
-        if not self.storage_channel_id:
+        """Main storage channel, looked up on first use (None if there is none yet)"""
+        # Upload worker threads have no app context; callers resolve it before fanning out
+        if not self.storage_channel_id and has_app_context():
             self.storage_channel_id = self._get_initial_storage_channel()
         return self.storage_channel_id
     
+    def get_shard(self, shard_id):
+        """Shard a file was stored on (None for files from before sharding means shard 0)"""
+        shard_id = shard_id or 0
+        return self.shards[shard_id] if shard_id < len(self.shards) else None
+    
+    def shard_channel(self, shard):
+        return self.get_storage_channel() if shard.id == 0 else shard.channel_id
+    
+    def pick_shard(self):
+        """Shard for a new upload: fewest uploads in progress here, then least recently picked"""
+        with self._shard_lock:
+            shard = min(self.shards, key=lambda s: (s.uploads, s.last_picked))
+            shard.last_picked = next(self._picks)
+            return shard
+    
+    def shard_stats(self):
+        """Load of each shard for /api/stats (public, so channel ids are left out)"""
+        return [{
+            'shard': shard.id,
+            'uploads': shard.uploads,
+            'client': shard.client.stats()
+        } for shard in self.shards]
+    
+    def set_webhook(self):
+        if not Config.TELEGRAM_WEBHOOK_URL:
+            print("⚠️ TELEGRAM_WEBHOOK_URL not set, expecting the webhook to be registered already")
+            return
+        data = {
+            'url': Config.TELEGRAM_WEBHOOK_URL,
+            'allowed_updates': json.dumps(['message']),
+            'secret_token': Config.TELEGRAM_WEBHOOK_SECRET
+        }
+        try:
+            response = self.client.call('setWebhook', data=data)
+            print(f"✅ Telegram webhook set: {response.status_code == 200}")
+        except Exception as e:
+            print(f"Could not set webhook: {e}")
+    
+    def webhook_authorized(self, secret):
+        """Whether a webhook call carries our secret token (never without a configured secret)"""
+        if not Config.TELEGRAM_WEBHOOK_SECRET or not secret:
+            return False
+        return hmac.compare_digest(secret.encode(), Config.TELEGRAM_WEBHOOK_SECRET.encode())
+    
+    def process_updates(self, updates):
+        """Handle a batch of updates, one bad update doesn't hold up the rest"""
+        for update in updates:
+            try:
+                self._handle_update(update)
+            except Exception as e:
+                print(f"Update {update.get('update_id')} failed: {e}")
+    
+    def _acquire_lease(self):
+        """Take or renew the polling lease (a bot_state row), True if this process holds it"""
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=Config.TELEGRAM_POLL_LEASE_TTL)
+        renewed = BotState.query.filter(
+            BotState.key == 'polling_leader',
+            (BotState.value == self.instance_id) | (BotState.expires_at < now)
+        ).update({'value': self.instance_id, 'expires_at': expires_at, 'updated_at': now}, synchronize_session=False)
+        db.session.commit()
+        if not renewed and not db.session.get(BotState, 'polling_leader'):
+            db.session.add(BotState(key='polling_leader', value=self.instance_id, expires_at=expires_at))
+            try:
+                db.session.commit()
+                renewed = 1
+            except IntegrityError:
+                db.session.rollback()
+        return bool(renewed)
+    
+    def _release_lease(self):
+        """Let another process take over polling right away on shutdown"""
+        if not self.is_leader:
+            return
+        try:
+            with self.app.app_context():
+                BotState.query.filter_by(key='polling_leader', value=self.instance_id).update(
+                    {'expires_at': datetime.utcnow()}, synchronize_session=False
+                )
+                db.session.commit()
+        except Exception as e:
+            print(f"Could not release polling lease: {e}")
+    
+    def _load_offset(self):
+        state = db.session.get(BotState, 'update_offset')
+        return int(state.value) if state and state.value else 0
+    
+    def _save_offset(self, offset):
+        upsert(BotState, {'key': 'update_offset', 'value': str(offset)}, {'value': str(offset)})
+        db.session.commit()
+    
     def _poll_updates(self):
         while True:
             try:
-                url = f"{self.api_base}/getUpdates"
+                with self.app.app_context():
+                    leader = self._acquire_lease()
+                    offset = self._load_offset() if leader else None
+                
+                if leader and not self.is_leader:
+                    # getUpdates is refused while a webhook is set
+                    self.client.call('deleteWebhook', data={}, priority=None)
+                    print(f"📡 Polling leader: {self.instance_id}")
+                self.is_leader = leader
+                if not leader:
+                    time.sleep(Config.TELEGRAM_POLL_LEASE_TTL / 3)
+                    continue
+                
                 params = {
-                    'offset': self.last_update_id + 1,
-                    'timeout': 30,
+                    'offset': offset,
+                    'limit': Config.TELEGRAM_POLL_BATCH,
+                    'timeout': Config.TELEGRAM_POLL_TIMEOUT,
                     'allowed_updates': json.dumps(['message'])
                 }
-                response = requests.get(url, params=params, timeout=35)
-                if response.status_code == 200:
-                    data = response.json()
-                    if data.get('ok') and data.get('result'):
-                        for update in data['result']:
-                            self.last_update_id = update['update_id']
-                            self._handle_update(update)
+                response = self.client.call('getUpdates', params=params, priority=None)
+                if response.status_code != 200:
+                    time.sleep(5)
+                    continue
+                data = response.json()
+                updates = data.get('result') if data.get('ok') else None
+                if not updates:
+                    continue
+                
+                with self.app.app_context():
+                    self.process_updates(updates)
+                    # Persisted after the batch, so a restart (or a new leader) resumes here
+                    self._save_offset(updates[-1]['update_id'] + 1)
             except Exception as e:
                 print(f"Polling error: {e}")
                 time.sleep(5)
@@ -109,10 +406,18 @@ class TelegramHandler:
         
         if 'contact' in message:
             contact = message['contact']
+            # A forwarded contact card is someone else's number, only the sender's own counts
+            sender_id = message.get('from', {}).get('id')
+            if not sender_id or contact.get('user_id') != sender_id:
+                self._send_contact_request(
+                    chat_id,
+                    "⚠️ Please share <b>your own</b> phone number with the button below 👇"
+                )
+                return
             phone = contact.get('phone_number', '')
             first_name = contact.get('first_name', '')
             self.register_phone(phone, chat_id, first_name)
-            self.send_message(chat_id, "✅ <b>Verified!</b>\nNow login on Vimesta Cloud.")
+            self.send_message(chat_id, "✅ <b>Verified!</b>\nNow login on Vimesta Cloud.", priority=PRIORITY_AUTH)
             return
         
         if 'text' in message:
@@ -124,29 +429,27 @@ class TelegramHandler:
                 )
     
     def _send_contact_request(self, chat_id, text):
-        url = f"{self.api_base}/sendMessage"
         keyboard = {
             'keyboard': [[{'text': '📱 Share Phone', 'request_contact': True}]],
             'resize_keyboard': True,
             'one_time_keyboard': True
         }
         try:
-            requests.post(url, data={
+            self.client.call('sendMessage', data={
                 'chat_id': chat_id,
                 'text': text,
                 'parse_mode': 'HTML',
                 'reply_markup': json.dumps(keyboard)
-            })
+            }, chat_id=chat_id, priority=PRIORITY_AUTH)
         except:
             pass
     
-    def send_message(self, chat_id, text, silent=False):
-        url = f"{self.api_base}/sendMessage"
+    def send_message(self, chat_id, text, silent=False, priority=PRIORITY_TRANSFER):
         try:
             data = {'chat_id': chat_id, 'text': text, 'parse_mode': 'HTML'}
             if silent:
                 data['disable_notification'] = True
-            response = requests.post(url, data=data)
+            response = self.client.call('sendMessage', data=data, chat_id=chat_id, priority=priority)
             if response.status_code == 200:
                 result = response.json()
                 return {'success': result.get('ok', False), 'message_id': result.get('result', {}).get('message_id')}
@@ -154,29 +457,92 @@ class TelegramHandler:
         except Exception as e:
             return {'success': False, 'error': str(e)}
     
-    def upload_file_hidden(self, file_path, filename, user_telegram_id, user_phone):
+    def upload_file_hidden(self, file_path, filename, user_telegram_id, user_phone, progress=None, sha256=None):
         """
         Upload file to HIDDEN storage (for Vimesta Cloud)
         Then send brief notification to user and DELETE it
         """
-        storage_id = self.get_storage_channel()
+        try:
+            shard = self.pick_shard()
+            size = os.path.getsize(file_path)
+            if size > Config.STRIPE_PART_SIZE:
+                return self.upload_file_striped(file_path, filename, user_telegram_id, user_phone,
+                                                progress=progress, sha256=sha256, shard=shard)
+            with open(file_path, 'rb') as f:
+                return self.upload_stream_hidden(
+                    f, filename, user_telegram_id, user_phone, size=size, progress=progress, shard=shard
+                )
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+    
+    def upload_file_striped(self, file_path, filename, user_telegram_id, user_phone, progress=None, sha256=None,
+                            shard=None):
+        """Upload a local file too large for one message as parts, several at a time"""
+        shard = shard or self.pick_shard()
+        size = os.path.getsize(file_path)
+        if sha256 is None:
+            with open(file_path, 'rb') as f:
+                sha256 = hashlib.file_digest(f, 'sha256').hexdigest()
+        
+        result = self._store_parts(
+            shard, lambda offset, length: FileSlice(open(file_path, 'rb'), length, offset=offset, owns=True),
+            filename, user_phone, size, Config.STRIPE_UPLOAD_WORKERS, progress
+        )
+        if result['success']:
+            result['sha256'] = sha256
+            self._notify_upload(user_telegram_id, filename)
+        return result
+    
+    def upload_stream_hidden(self, stream, filename, user_telegram_id, user_phone, size=None, progress=None,
+                             shard=None):
+        """
+        Same as upload_file_hidden, but reads the file from any stream
+        (e.g. the incoming request body) without touching local disk
+        """
+        shard = shard or self.pick_shard()
+        storage_id = self.shard_channel(shard)
         
         if not storage_id:
             return {'success': False, 'error': 'No storage configured'}
         
+        if size and size > Config.STRIPE_PART_SIZE:
+            # A stream can only be read in order, so its parts go one after another
+            digest = hashlib.sha256()
+            result = self._store_parts(
+                shard, lambda offset, length: FileSlice(stream, length, digest=digest),
+                filename, user_phone, size, 1, progress
+            )
+            if result['success']:
+                result['sha256'] = digest.hexdigest()
+                self._notify_upload(user_telegram_id, filename)
+            return result
+        
         # 1. Upload to HIDDEN storage (permanent, for cloud)
-        url = f"{self.api_base}/sendDocument"
         file_caption = f"📁 {filename}\n👤 {user_phone}"
+        result = self._store_document(shard, stream, filename, file_caption, size=size, progress=progress)
+        if not result['success']:
+            return result
         
+        # 2. Send brief notification to user's chat (will be deleted)
+        self._notify_upload(user_telegram_id, filename)
+        
+        result['storage_channel'] = storage_id
+        result['shard'] = shard.id
+        return result
+    
+    def _store_document(self, shard, stream, filename, caption, size=None, progress=None):
+        """sendDocument one stream to the shard's storage channel"""
+        storage_id = self.shard_channel(shard)
+        with self._shard_lock:
+            shard.uploads += 1
         try:
-            with open(file_path, 'rb') as f:
-                files = {'document': (filename, f)}
-                data = {
-                    'chat_id': storage_id,
-                    'caption': file_caption,
-                    'disable_notification': True
-                }
-                response = requests.post(url, files=files, data=data, timeout=300)
+            body = MultipartStream(
+                {'chat_id': storage_id, 'caption': caption, 'disable_notification': 'true'},
+                'document', filename, stream, size=size, progress=progress
+            )
+            response = shard.client.call(
+                'sendDocument', body=body, headers={'Content-Type': body.content_type}, chat_id=storage_id
+            )
             
             if response.status_code != 200:
                 return {'success': False, 'error': f"Storage upload failed"}
@@ -187,47 +553,145 @@ class TelegramHandler:
             
             storage_message = result['result']
             document = storage_message.get('document', {})
-            
-            # 2. Send brief notification to user's chat (will be deleted)
-            if user_telegram_id and user_telegram_id != storage_id:
-                notify_result = self.send_message(
-                    user_telegram_id,
-                    f"☁️ <b>Uploaded to Cloud!</b>\n📁 {filename}",
-                    silent=True
-                )
-                
-                # 3. Delete notification after 2 seconds (in background)
-                if notify_result.get('success') and notify_result.get('message_id'):
-                    def delete_later():
-                        time.sleep(2)
-                        self.delete_message(user_telegram_id, notify_result['message_id'])
-                    
-                    threading.Thread(target=delete_later, daemon=True).start()
+            thumbnail = document.get('thumbnail') or document.get('thumb') or {}
             
             return {
                 'success': True,
                 'message_id': storage_message['message_id'],
                 'file_id': document.get('file_id'),
-                'file_size': document.get('file_size', 0),
-                'storage_channel': storage_id
+                'file_size': body.bytes_read,
+                'sha256': body.sha256.hexdigest(),
+                'thumb_file_id': thumbnail.get('file_id'),
+                'thumb_size': thumbnail.get('file_size')
             }
             
         except Exception as e:
             return {'success': False, 'error': str(e)}
+        finally:
+            with self._shard_lock:
+                shard.uploads -= 1
     
-    def send_file_to_storage(self, file_path, filename, user_phone, caption=None):
+    def _store_parts(self, shard, open_part, filename, user_phone, size, workers, progress=None):
+        """
+        Store size bytes as consecutive messages of at most STRIPE_PART_SIZE.
+        open_part(offset, length) returns the part's data; up to workers parts
+        are sent at once. If any part fails, the parts already sent are deleted.
+        """
+        storage_id = self.shard_channel(shard)
+        if not storage_id:
+            return {'success': False, 'error': 'No storage configured'}
+        
+        part_size = Config.STRIPE_PART_SIZE
+        offsets = list(range(0, size, part_size))
+        sent = [0] * len(offsets)
+        
+        def send(index):
+            offset = offsets[index]
+            length = min(part_size, size - offset)
+            caption = f"📁 {filename} ({index + 1}/{len(offsets)})\n👤 {user_phone}"
+            
+            def part_progress(bytes_sent):
+                sent[index] = bytes_sent
+            
+            try:
+                part = open_part(offset, length)
+                try:
+                    result = self._store_document(shard, part, f"{filename}.{index + 1:03d}", caption,
+                                                  size=length, progress=part_progress)
+                finally:
+                    part.close()
+            except Exception as e:
+                result = {'success': False, 'error': str(e)}
+            if result['success'] and result['file_size'] != length:
+                result = {'success': False, 'error': 'Incomplete part', 'message_id': result['message_id']}
+            return dict(result, part_index=index, offset=offset, size=length)
+        
+        results = []
+        failed = False
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='stripe-upload') as executor:
+            pending = {executor.submit(send, i) for i in range(len(offsets))}
+            while pending:
+                # Progress is reported from the calling thread (it may write to the database)
+                done, pending = wait(pending, timeout=1)
+                for future in done:
+                    if future.cancelled():
+                        continue
+                    result = future.result()
+                    results.append(result)
+                    if not result['success'] and not failed:
+                        failed = True
+                        for other in pending:
+                            other.cancel()
+                if progress and not failed:
+                    progress(sum(sent))
+        
+        if failed:
+            for result in results:
+                self.delete_stored_later(shard.id, [result.get('message_id')])
+            error = next(r['error'] for r in results if not r['success'])
+            return {'success': False, 'error': f"Part upload failed: {error}"}
+        
+        parts = [{
+            'part_index': r['part_index'],
+            'file_id': r['file_id'],
+            'message_id': r['message_id'],
+            'offset': r['offset'],
+            'size': r['size']
+        } for r in sorted(results, key=lambda r: r['part_index'])]
+        
+        return {
+            'success': True,
+            'message_id': parts[0]['message_id'],
+            'file_id': parts[0]['file_id'],
+            'file_size': size,
+            'storage_channel': storage_id,
+            'shard': shard.id,
+            'part_count': len(parts),
+            'parts': parts
+        }
+    
+    def _notify_upload(self, user_telegram_id, filename):
+        """Brief upload notice in the user's chat, deleted again shortly after"""
+        if not user_telegram_id or user_telegram_id == self.storage_channel_id:
+            return
+        
+        def notify():
+            notify_result = self.send_message(
+                user_telegram_id,
+                f"☁️ <b>Uploaded to Cloud!</b>\n📁 {filename}",
+                silent=True,
+                priority=PRIORITY_BACKGROUND
+            )
+            
+            # 3. Delete notification after 2 seconds (coalesced with other deletes)
+            if notify_result.get('success') and notify_result.get('message_id'):
+                self.delete_message_later(user_telegram_id, notify_result['message_id'], delay=2)
+        
+        # Off the upload path, at background priority
+        self.client.deferred.submit(notify)
+    
+    def send_file_to_storage(self, file_path, filename, user_phone, caption=None, progress=None, sha256=None):
         """Legacy method - redirect to new hidden upload"""
         user_data = self.get_telegram_id_by_phone(user_phone)
         user_telegram_id = user_data.get('telegram_id') if user_data else None
-        return self.upload_file_hidden(file_path, filename, user_telegram_id, user_phone)
+        return self.upload_file_hidden(file_path, filename, user_telegram_id, user_phone,
+                                       progress=progress, sha256=sha256)
+    
+    def send_stream_to_storage(self, stream, filename, user_phone, size=None):
+        user_data = self.get_telegram_id_by_phone(user_phone)
+        user_telegram_id = user_data.get('telegram_id') if user_data else None
+        return self.upload_stream_hidden(stream, filename, user_telegram_id, user_phone, size=size)
     
     def send_file_sync(self, chat_id, file_path, filename, caption=None):
-        url = f"{self.api_base}/sendDocument"
         try:
             with open(file_path, 'rb') as f:
-                files = {'document': (filename, f)}
-                data = {'chat_id': chat_id, 'caption': caption or filename, 'disable_notification': True}
-                response = requests.post(url, files=files, data=data, timeout=300)
+                body = MultipartStream(
+                    {'chat_id': chat_id, 'caption': caption or filename, 'disable_notification': 'true'},
+                    'document', filename, f, size=os.path.getsize(file_path)
+                )
+                response = self.client.call(
+                    'sendDocument', body=body, headers={'Content-Type': body.content_type}, chat_id=chat_id
+                )
             if response.status_code == 200:
                 result = response.json()
                 if result.get('ok'):
@@ -238,26 +702,61 @@ class TelegramHandler:
         except Exception as e:
             return {'success': False, 'error': str(e)}
     
-    def get_file_url(self, file_id):
-        url = f"{self.api_base}/getFile"
+    def get_file_url(self, file_id, shard_id=None):
+        """getFile through the bot of the shard the file is stored on"""
+        shard = self.get_shard(shard_id)
+        if not shard:
+            return {'success': False, 'error': f'Unknown storage shard {shard_id}'}
         try:
-            response = requests.get(url, params={'file_id': file_id})
+            response = shard.client.call('getFile', params={'file_id': file_id})
             if response.status_code == 200:
                 result = response.json()
                 if result.get('ok'):
                     file_path = result['result']['file_path']
-                    return {'success': True, 'url': f"https://api.telegram.org/file/bot{self.bot_token}/{file_path}"}
+                    return {'success': True, 'file_path': file_path, 'url': shard.client.file_url(file_path)}
             return {'success': False, 'error': response.text}
         except Exception as e:
             return {'success': False, 'error': str(e)}
     
-    def delete_message(self, chat_id, message_id):
-        url = f"{self.api_base}/deleteMessage"
+    def delete_message(self, chat_id, message_id, priority=PRIORITY_BACKGROUND):
         try:
-            response = requests.post(url, data={'chat_id': chat_id, 'message_id': message_id})
+            response = self.client.call(
+                'deleteMessage', data={'chat_id': chat_id, 'message_id': message_id},
+                chat_id=chat_id, priority=priority
+            )
             return {'success': response.status_code == 200}
         except:
             return {'success': False}
+    
+    def delete_message_later(self, chat_id, message_id, delay=0):
+        """Queue a delete, deletes for the same chat go out together via deleteMessages"""
+        self.client.deferred.delete_message(chat_id, message_id, delay=delay)
+    
+    def delete_stored_later(self, shard_id, message_ids):
+        """Queue the delete of storage messages, through the bot of their shard"""
+        shard = self.get_shard(shard_id)
+        storage_id = self.shard_channel(shard) if shard else None
+        message_ids = [m for m in message_ids if m]
+        if storage_id and message_ids:
+            shard.client.deferred.delete_messages(storage_id, message_ids)
+    
+    def download(self, file_path, shard_id=None, headers=None):
+        """GET a stored file (path from get_file_url) from the file server of its shard's bot"""
+        return self.get_shard(shard_id).client.download(file_path, headers=headers)
+
+
+_handler = None
+_handler_lock = threading.Lock()
+
+
+def get_telegram_handler():
+    global _handler
+    if _handler is None:
+        with _handler_lock:
+            if _handler is None:
+                _handler = TelegramHandler()
+    return _handler
 
 
-telegram_handler = TelegramHandler()
+# Built on first use, so importing this module has no side effects
+telegram_handler = LocalProxy(get_telegram_handler)
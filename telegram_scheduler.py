@@ -0,0 +1,242 @@
+import json
+import time
+import bisect
+import itertools
+import threading
+from collections import deque
+
+from config import Config
+
+# Priority classes, lower goes first
+PRIORITY_AUTH = 0        # OTP and login flow
+PRIORITY_TRANSFER = 1    # uploads and getFile
+PRIORITY_BACKGROUND = 2  # notifications and cleanup deletes
+
+PRIORITY_NAMES = {PRIORITY_AUTH: 'auth', PRIORITY_TRANSFER: 'transfer', PRIORITY_BACKGROUND: 'background'}
+
+MAX_CHAT_BUCKETS = 10000
+MAX_DELETE_BATCH = 100  # deleteMessages limit
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        self._refill(now)
+        wait = max(0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, seconds, now):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0
+        self.updated = now
+
+    def idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+
+class RequestScheduler:
+    """
+    Admission control for Bot API calls of one bot.
+    A call needs a token from the global bucket and, when it targets a
+    chat, from that chat's bucket. Waiting callers are served by priority
+    class, then arrival order; 429 retry_after blocks the bucket it hit.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._global = TokenBucket(Config.TELEGRAM_GLOBAL_RATE, Config.TELEGRAM_GLOBAL_RATE)
+        self._chats = {}
+        self._waiting = []
+        self._seq = itertools.count()
+        self._stats = {
+            'granted': {name: 0 for name in PRIORITY_NAMES.values()},
+            'rate_limited': 0,
+            'wait_seconds': 0.0
+        }
+
+    def _is_group(self, chat_id):
+        # Groups and channels have negative ids (or @usernames)
+        return str(chat_id).startswith(('-', '@'))
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= MAX_CHAT_BUCKETS:
+                self._prune()
+            if self._is_group(chat_id):
+                bucket = TokenBucket(Config.TELEGRAM_GROUP_RATE, Config.TELEGRAM_GROUP_BURST)
+            else:
+                bucket = TokenBucket(Config.TELEGRAM_CHAT_RATE, Config.TELEGRAM_CHAT_BURST)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _prune(self):
+        now = time.monotonic()
+        for chat_id in [c for c, b in self._chats.items() if b.idle(now)]:
+            del self._chats[chat_id]
+
+    def _chat_wait(self, chat_id, now):
+        if chat_id is None:
+            return 0
+        return self._chat_bucket(chat_id).wait_time(now)
+
+    def _wait_time(self, ticket, now):
+        wait = max(self._chat_wait(ticket[2], now), self._global.wait_time(now))
+        if wait > 0:
+            return wait
+        # Anyone queued ahead whose chat is ready gets the global token first
+        for other in self._waiting:
+            if other is ticket:
+                break
+            if self._chat_wait(other[2], now) <= 0:
+                return 0.01
+        return 0
+
+    def acquire(self, chat_id=None, priority=PRIORITY_TRANSFER):
+        started = time.monotonic()
+        ticket = (priority, next(self._seq), chat_id)
+        with self._cond:
+            bisect.insort(self._waiting, ticket, key=lambda t: t[:2])
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._wait_time(ticket, now)
+                    if wait <= 0:
+                        self._global.take(now)
+                        if chat_id is not None:
+                            self._chat_bucket(chat_id).take(now)
+                        self._stats['granted'][PRIORITY_NAMES.get(priority, 'transfer')] += 1
+                        self._stats['wait_seconds'] += now - started
+                        return
+                    self._cond.wait(min(wait, 1.0))
+            finally:
+                self._waiting.remove(ticket)
+                self._cond.notify_all()
+
+    def penalize(self, chat_id, retry_after):
+        """Honor a 429 retry_after for the chat (or the whole bot)"""
+        with self._cond:
+            now = time.monotonic()
+            bucket = self._chat_bucket(chat_id) if chat_id is not None else self._global
+            bucket.block(retry_after, now)
+            self._stats['rate_limited'] += 1
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            stats = {
+                'granted': dict(self._stats['granted']),
+                'rate_limited': self._stats['rate_limited'],
+                'wait_seconds': round(self._stats['wait_seconds'], 3),
+                'waiting': len(self._waiting),
+                'tracked_chats': len(self._chats)
+            }
+        return stats
+
+
+class DeferredCalls:
+    """
+    Background lane for deferrable work (notifications, cleanup deletes).
+    Runs on one thread at background priority; pending deletes for the
+    same chat are coalesced into deleteMessages calls.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._cond = threading.Condition()
+        self._tasks = deque()
+        self._deletes = {}  # chat_id -> [(due, message_id)]
+        self._thread = None
+        self._stats = {'tasks': 0, 'deletes': 0, 'delete_calls': 0}
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='telegram-deferred', daemon=True)
+            self._thread.start()
+
+    def submit(self, fn):
+        with self._cond:
+            self._tasks.append(fn)
+            self._ensure_thread()
+            self._cond.notify()
+
+    def delete_message(self, chat_id, message_id, delay=0):
+        self.delete_messages(chat_id, [message_id], delay=delay)
+
+    def delete_messages(self, chat_id, message_ids, delay=0):
+        """Queue several deletes at once, so they go out in the same deleteMessages calls"""
+        due = time.monotonic() + delay
+        with self._cond:
+            self._deletes.setdefault(chat_id, []).extend((due, message_id) for message_id in message_ids)
+            self._ensure_thread()
+            self._cond.notify()
+
+    def _next_work(self):
+        with self._cond:
+            while True:
+                if self._tasks:
+                    return self._tasks.popleft(), None
+                now = time.monotonic()
+                # A due delete also takes the ones due shortly after it
+                horizon = now + Config.TELEGRAM_COALESCE_WINDOW
+                for chat_id, pending in self._deletes.items():
+                    if min(due for due, _ in pending) <= now:
+                        batch = [m for due, m in pending if due <= horizon]
+                        rest = [(due, m) for due, m in pending if due > horizon]
+                        if rest:
+                            self._deletes[chat_id] = rest
+                        else:
+                            del self._deletes[chat_id]
+                        return None, (chat_id, batch)
+                timeout = None
+                if self._deletes:
+                    timeout = min(due for p in self._deletes.values() for due, _ in p) - now
+                self._cond.wait(timeout)
+
+    def _run(self):
+        while True:
+            task, deletes = self._next_work()
+            try:
+                if task:
+                    self._stats['tasks'] += 1
+                    task()
+                else:
+                    self._flush_deletes(*deletes)
+            except Exception as e:
+                print(f"Deferred Telegram call failed: {e}")
+
+    def _flush_deletes(self, chat_id, message_ids):
+        self._stats['deletes'] += len(message_ids)
+        for i in range(0, len(message_ids), MAX_DELETE_BATCH):
+            batch = message_ids[i:i + MAX_DELETE_BATCH]
+            self._stats['delete_calls'] += 1
+            if len(batch) == 1:
+                self.client.call('deleteMessage', data={'chat_id': chat_id, 'message_id': batch[0]},
+                                 chat_id=chat_id, priority=PRIORITY_BACKGROUND)
+            else:
+                self.client.call('deleteMessages', data={'chat_id': chat_id, 'message_ids': json.dumps(batch)},
+                                 chat_id=chat_id, priority=PRIORITY_BACKGROUND)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats['pending_tasks'] = len(self._tasks)
+            stats['pending_deletes'] = sum(len(p) for p in self._deletes.values())
+        return stats
@@ -0,0 +1,96 @@
+import io
+
+from config import Config
+from cache import TTLCache
+from content_cache import ContentCache
+
+THUMBNAIL_TYPES = ('image', 'video')
+
+
+class Thumbnails:
+    """
+    Small JPEG previews for images and videos.
+    Telegram makes a thumbnail for most images and videos sent as documents;
+    its file_id is recorded at upload and fetched on first request. Images
+    without one are scaled down here if Pillow is installed. Both kinds are
+    kept in their own on-disk LRU cache, since a thumbnail never changes.
+    """
+
+    def __init__(self):
+        self.cache = ContentCache(
+            Config.THUMBNAIL_CACHE_FOLDER,
+            Config.THUMBNAIL_CACHE_MAX_BYTES,
+            max_file_size=Config.THUMBNAIL_CACHE_MAX_BYTES
+        )
+        self._image = None
+        # Images that could not be rendered (broken, or fetch failed) are not retried for a while
+        self._failed = TTLCache(10000, 600)
+
+    def _pillow(self):
+        """PIL.Image, or False without Pillow (imported on first use)"""
+        if self._image is None:
+            try:
+                from PIL import Image
+                self._image = Image
+            except ImportError:
+                self._image = False
+        return self._image
+
+    def telegram_key(self, file_record):
+        return f"telegram:{file_record.thumb_file_id}"
+
+    def rendered_key(self, file_record):
+        return f"rendered:{file_record.telegram_file_id}"
+
+    def can_render(self, file_record):
+        return (
+            file_record.file_type == 'image'
+            and not file_record.part_count
+            and not self._failed.get(file_record.telegram_file_id)
+            and 0 < (file_record.file_size or 0) <= Config.THUMBNAIL_SOURCE_MAX_SIZE
+            and bool(self._pillow())
+        )
+
+    def available(self, file_record):
+        """Whether the file has a thumbnail (from Telegram, or one that can be rendered)"""
+        if file_record.file_type not in THUMBNAIL_TYPES or not file_record.telegram_file_id:
+            return False
+        return bool(file_record.thumb_file_id and file_record.thumb_size) or self.can_render(file_record)
+
+    def render(self, blocks):
+        """Scale an image (iterator of bytes) down to a JPEG, returns [bytes] or None"""
+        if blocks is None:
+            return None
+        Image = self._pillow()
+        source = io.BytesIO()
+        for block in blocks:
+            source.write(block)
+        source.seek(0)
+
+        from PIL import ImageOps
+        with Image.open(source) as image:
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((Config.THUMBNAIL_SIZE, Config.THUMBNAIL_SIZE))
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            out = io.BytesIO()
+            image.save(out, 'JPEG', quality=80, optimize=True)
+        return [out.getvalue()]
+
+    def render_failed(self, file_record):
+        self._failed.set(file_record.telegram_file_id, True)
+
+    def cache_keys(self, file_record):
+        """Cache entries of the file's content, to drop once the content is deleted"""
+        keys = [self.rendered_key(file_record)]
+        if file_record.thumb_file_id:
+            keys.append(self.telegram_key(file_record))
+        return keys
+
+    def stats(self):
+        stats = self.cache.stats()
+        stats['pillow'] = bool(self._pillow())
+        return stats
+
+
+thumbnails = Thumbnails()
@@ -238,51 +238,95 @@ const DragDropHandler = {
     }
 };
 
-// Chunk uploader for large files (optional, for future use)
+// Chunk uploader for large files (resumable)
 const ChunkUploader = {
     chunkSize: 10 * 1024 * 1024, // 10MB chunks
+    parallel: 3,
 
-    async uploadInChunks(file, folderId = null, onProgress = () => { }) {
-        const totalChunks = Math.ceil(file.size / this.chunkSize);
-        let uploadedChunks = 0;
-
-        for (let i = 0; i < totalChunks; i++) {
-            const start = i * this.chunkSize;
-            const end = Math.min(start + this.chunkSize, file.size);
-            const chunk = file.slice(start, end);
+    // Remember upload sessions so a dropped upload resumes instead of restarting
+    sessionKey(file) {
+        return `vimesta_upload_${file.name}_${file.size}_${file.lastModified}`;
+    },
 
-            const formData = new FormData();
-            formData.append('chunk', chunk);
-            formData.append('filename', file.name);
-            formData.append('chunk_index', i);
-            formData.append('total_chunks', totalChunks);
-            if (folderId) {
-                formData.append('folder_id', folderId);
+    async api(endpoint, options = {}) {
+        const response = await fetch(`${App.apiUrl}${endpoint}`, {
+            ...options,
+            headers: {
+                'Authorization': `Bearer ${App.token}`,
+                ...options.headers
             }
+        });
+        const data = await response.json();
+        if (!response.ok || !data.success) {
+            throw new Error(data.error || `Request failed with status ${response.status}`);
+        }
+        return data;
+    },
+
+    async getSession(file) {
+        const key = this.sessionKey(file);
+        const uploadId = localStorage.getItem(key);
 
+        if (uploadId) {
             try {
-                const response = await fetch(`${App.apiUrl}/files/upload-chunk`, {
-                    method: 'POST',
-                    headers: {
-                        'Authorization': `Bearer ${App.token}`
-                    },
-                    body: formData
-                });
+                const data = await this.api(`/files/upload/${uploadId}`);
+                return data.upload;
+            } catch (error) {
+                localStorage.removeItem(key);
+            }
+        }
 
-                if (!response.ok) {
-                    throw new Error(`Chunk ${i + 1} upload failed`);
-                }
+        const data = await this.api('/files/upload/init', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ filename: file.name, size: file.size, chunk_size: this.chunkSize })
+        });
+        localStorage.setItem(key, data.upload.upload_id);
+        return data.upload;
+    },
 
-                uploadedChunks++;
-                const progress = Math.round((uploadedChunks / totalChunks) * 100);
-                onProgress(progress);
+    async uploadChunk(file, upload, index) {
+        const start = index * upload.chunk_size;
+        const end = Math.min(start + upload.chunk_size, file.size);
 
-            } catch (error) {
-                throw new Error(`Failed to upload chunk ${i + 1}: ${error.message}`);
+        const formData = new FormData();
+        formData.append('upload_id', upload.upload_id);
+        formData.append('chunk_index', index);
+        formData.append('chunk', file.slice(start, end));
+
+        try {
+            await this.api('/files/upload-chunk', { method: 'POST', body: formData });
+        } catch (error) {
+            throw new Error(`Failed to upload chunk ${index + 1}: ${error.message}`);
+        }
+    },
+
+    async uploadInChunks(file, folderId = null, onProgress = () => { }) {
+        const upload = await this.getSession(file);
+        const pending = [...upload.missing_chunks];
+        let uploadedChunks = upload.total_chunks - pending.length;
+
+        onProgress(Math.round((uploadedChunks / upload.total_chunks) * 100));
+
+        const worker = async () => {
+            while (pending.length > 0) {
+                const index = pending.shift();
+                await this.uploadChunk(file, upload, index);
+                uploadedChunks++;
+                onProgress(Math.round((uploadedChunks / upload.total_chunks) * 100));
             }
+        };
+
+        const workers = [];
+        for (let i = 0; i < Math.min(this.parallel, pending.length); i++) {
+            workers.push(worker());
         }
+        await Promise.all(workers);
+
+        const data = await this.api(`/files/upload/${upload.upload_id}/complete`, { method: 'POST' });
+        localStorage.removeItem(this.sessionKey(file));
 
-        return { success: true, message: 'File uploaded successfully' };
+        return { success: true, message: 'File uploaded successfully', file: data.file };
     }
 };
 
@@ -0,0 +1,190 @@
+import os
+import time
+import uuid
+import threading
+from datetime import datetime, timedelta
+from werkzeug.utils import secure_filename
+
+from config import Config
+from models import db, UploadJob, BotState, upsert
+
+
+class UploadJobQueue:
+    """
+    Persistent upload queue.
+    Jobs live in the upload_jobs table and are claimed atomically, so any
+    number of processes can run workers; the HTTP request only stages the
+    file and returns the job id. Running workers keep a heartbeat row
+    fresh, so processes without workers can tell whether a job would
+    ever be picked up.
+    """
+
+    def __init__(self):
+        self.workers = Config.UPLOAD_WORKERS
+        self.folder = Config.UPLOAD_JOB_FOLDER
+        self.app = None
+        self.processor = None
+        self._threads = []
+        self._wakeup = threading.Event()
+        self._last_maintenance = 0
+        self._last_heartbeat = 0
+
+    def start(self, app, processor):
+        """processor(job, progress) uploads one job and returns a result dict with 'file'"""
+        if self._threads:
+            return
+        self.app = app
+        self.processor = processor
+        os.makedirs(self.folder, exist_ok=True)
+        with app.app_context():
+            self._heartbeat()
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"upload-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        print(f"✅ Upload workers started: {self.workers}")
+
+    def accepting(self):
+        """Whether upload workers run in this or another process"""
+        if self._threads:
+            return True
+        state = db.session.get(BotState, 'upload_workers')
+        return bool(state and state.expires_at and state.expires_at > datetime.utcnow())
+
+    def staging_path(self, filename):
+        os.makedirs(self.folder, exist_ok=True)
+        return os.path.join(self.folder, f"{uuid.uuid4().hex}_{secure_filename(filename) or 'file'}")
+
+    def enqueue(self, user, staged_path, filename):
+        job = UploadJob(
+            user_id=user.id,
+            filename=filename,
+            staged_path=staged_path,
+            file_size=os.path.getsize(staged_path)
+        )
+        db.session.add(job)
+        db.session.commit()
+        self._wakeup.set()
+        return job
+
+    def get_job(self, user, job_id):
+        return UploadJob.query.filter_by(id=job_id, user_id=user.id).first()
+
+    def _work(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    self._heartbeat()
+                    self._maintenance()
+                    job = self._claim_next()
+                    if job:
+                        self._run(job)
+                        continue
+            except Exception as e:
+                print(f"Upload worker error: {e}")
+            self._wakeup.wait(Config.UPLOAD_JOB_POLL_INTERVAL)
+            self._wakeup.clear()
+
+    def _claim_next(self):
+        now = datetime.utcnow()
+        candidates = UploadJob.query.filter(
+            UploadJob.status == 'queued',
+            UploadJob.available_at <= now
+        ).order_by(UploadJob.created_at).limit(self.workers).all()
+
+        for job in candidates:
+            # Conditional update, only one worker (in any process) wins the job
+            claimed = UploadJob.query.filter_by(id=job.id, status='queued').update({
+                'status': 'running',
+                'attempts': UploadJob.attempts + 1,
+                'updated_at': now
+            }, synchronize_session=False)
+            db.session.commit()
+            if claimed:
+                db.session.refresh(job)
+                return job
+        return None
+
+    def _run(self, job):
+        last_update = [0]
+
+        def progress(bytes_sent):
+            now = time.time()
+            if now - last_update[0] < 1:
+                return
+            last_update[0] = now
+            UploadJob.query.filter_by(id=job.id).update(
+                {'bytes_sent': bytes_sent, 'updated_at': datetime.utcnow()}, synchronize_session=False
+            )
+            db.session.commit()
+            # Workers busy with long uploads are still alive
+            self._heartbeat()
+
+        try:
+            result = self.processor(job, progress)
+        except Exception as e:
+            db.session.rollback()
+            result = {'success': False, 'error': str(e)}
+
+        job.updated_at = datetime.utcnow()
+        if result['success']:
+            db.session.flush()
+            job.status = 'completed'
+            job.file_id = result['file'].id
+            job.bytes_sent = job.file_size
+            job.error = None
+            db.session.commit()
+            self._remove_staged(job)
+        elif job.attempts < Config.UPLOAD_JOB_MAX_ATTEMPTS:
+            job.status = 'queued'
+            job.error = result.get('error')
+            job.available_at = datetime.utcnow() + timedelta(seconds=Config.UPLOAD_JOB_RETRY_DELAY * job.attempts)
+            db.session.commit()
+        else:
+            job.status = 'failed'
+            job.error = result.get('error')
+            db.session.commit()
+            self._remove_staged(job)
+            print(f"❌ Upload job {job.id} failed: {job.error}")
+
+    def _remove_staged(self, job):
+        if job.staged_path and os.path.exists(job.staged_path):
+            os.remove(job.staged_path)
+
+    def _heartbeat(self):
+        """Mark upload workers as alive for a few heartbeat intervals"""
+        now = time.time()
+        if now - self._last_heartbeat < Config.UPLOAD_WORKER_HEARTBEAT:
+            return
+        self._last_heartbeat = now
+        expires_at = datetime.utcnow() + timedelta(seconds=Config.UPLOAD_WORKER_HEARTBEAT * 3)
+        upsert(BotState, {'key': 'upload_workers', 'value': str(os.getpid()), 'expires_at': expires_at},
+               {'value': str(os.getpid()), 'expires_at': expires_at, 'updated_at': datetime.utcnow()})
+        db.session.commit()
+
+    def _maintenance(self):
+        """Requeue jobs of dead workers and drop old finished jobs, once a minute"""
+        now = time.time()
+        if now - self._last_maintenance < 60:
+            return
+        self._last_maintenance = now
+
+        stale = datetime.utcnow() - timedelta(seconds=Config.UPLOAD_JOB_STALE_AFTER)
+        requeued = UploadJob.query.filter(
+            UploadJob.status == 'running',
+            UploadJob.updated_at < stale
+        ).update({'status': 'queued', 'available_at': datetime.utcnow()}, synchronize_session=False)
+
+        expired = datetime.utcnow() - timedelta(seconds=Config.UPLOAD_JOB_RETENTION)
+        UploadJob.query.filter(
+            UploadJob.status.in_(['completed', 'failed']),
+            UploadJob.updated_at < expired
+        ).delete(synchronize_session=False)
+        db.session.commit()
+
+        if requeued:
+            print(f"♻️ Requeued {requeued} stalled upload jobs")
+
+
+upload_queue = UploadJobQueue()